@@ -0,0 +1,100 @@
+# Crash-safe file writes.
+# Everything is written to a temporary file in the target's directory, fsynced and renamed
+# over the target, so readers (the next run, media GC, the web server) see the old file or
+# the new one, never a truncated one. Temporary names start with "temp_", which media GC
+# already treats as work files, and never end in ".json", so feed discovery skips them.
+import contextlib
+import os
+import time
+
+TEMP_PREFIX = 'temp_'
+TEMP_SUFFIX = '.tmp'
+# Temporaries older than this were left by a killed run
+STALE_TEMP_AGE = 3600
+
+
+def temp_path_for(path, keep_extension=False):
+    # keep_extension is for writers that pick the format from the name (ffmpeg)
+    directory, name = os.path.split(path)
+    if keep_extension:
+        return os.path.join(directory, f"{TEMP_PREFIX}{os.getpid()}_{name}")
+    return os.path.join(directory, f"{TEMP_PREFIX}{name}.{os.getpid()}{TEMP_SUFFIX}")
+
+
+def fsync_file(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_dir(directory):
+    # Makes the rename itself durable; not every platform can open a directory
+    try:
+        fd = os.open(directory or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@contextlib.contextmanager
+def atomic_path(path, durable=True, keep_extension=False):
+    # Yields a temporary path for the caller (or a subprocess) to write; once the block
+    # finishes the file replaces path. On error the temporary is removed and path is untouched.
+    # A block that writes nothing leaves path alone.
+    tmp = temp_path_for(path, keep_extension)
+    try:
+        yield tmp
+        if not os.path.exists(tmp):
+            return
+        if durable:
+            fsync_file(tmp)
+        os.replace(tmp, path)
+        if durable:
+            fsync_dir(os.path.dirname(path))
+    except BaseException:
+        remove_quietly(tmp)
+        raise
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode='wb', durable=True, **kwargs):
+    with atomic_path(path, durable) as tmp:
+        with open(tmp, mode, **kwargs) as f:
+            yield f
+
+
+def atomic_write(path, data, durable=True):
+    # Returns the number of bytes written
+    with atomic_open(path, 'wb', durable) as f:
+        f.write(data)
+    return len(data)
+
+
+def cleanup_temp_files(directory, max_age=STALE_TEMP_AGE):
+    # Removes temporaries that killed runs left behind in directory
+    removed = 0
+    now = time.time()
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if entry.name.startswith(TEMP_PREFIX) and entry.name.endswith(TEMP_SUFFIX) and entry.is_file():
+            if now - entry.stat().st_mtime >= max_age:
+                remove_quietly(entry.path)
+                removed += 1
+    return removed
@@ -0,0 +1,101 @@
+# Micro-benchmark: compiled TextCleaner vs the original per-call re.sub chain.
+# Usage: python backend/benchmarks/bench_clean_text.py [--messages 20000] [--repeat 3]
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from text_cleaner import TextCleaner  # noqa: E402
+
+
+def legacy_clean_text(text):
+    # The pre-engine implementation, kept here as the baseline
+    if not text:
+        return ""
+    text = re.sub(r'\[[^\]]+\]\(https?://[^\s)]+\)', '', text)
+    text = re.sub(r'\(\s*https?://[^\s)]+\s*\)', '', text)
+    text = re.sub(r'\[\s*[a-zA-Z0-9.-]+\.[a-z]{2,}\s*\]', '', text)
+    text = re.sub(r'\[[📹📷🖼🎥]]', '', text)
+    text = re.sub(r'https?://[^\s]+', '', text)
+    text = re.sub(r'/%[0-9A-Fa-f]{2}', '', text)
+    text = re.sub(r'%[0-9A-Fa-f]{2}', '', text)
+    signatures = [
+        r'_+Farsi_Iranwire_+',
+        r'-- _IranintlTV',
+        r'VahidHeadline@ \W+',
+        r'VahidOnline@ \W+',
+        r'VahidOOnLine@ \W+',
+        r'VahidHeadline@',
+        r'VahidOnline@',
+        r'VahidOOnLine@'
+    ]
+    for sig in signatures:
+        text = re.sub(sig, '', text, flags=re.IGNORECASE)
+    text = re.sub(r'\n\s*\n', '\n\n', text)
+    return text.strip()
+
+
+WORDS = ['خبر', 'فوری', 'تهران', 'گزارش', 'امروز', 'news', 'update', 'iran', 'video', '۱۴۰۳']
+JUNK = [
+    '[منبع](https://example.com/a/b?c=%20d)',
+    '( https://t.me/channel/123 )',
+    '[ bbc.com ]',
+    '[📹]',
+    'https://www.iranintl.com/202401/%D8%AE%D8%A8%D8%B1',
+    '\n\n\n',
+]
+SIGNATURES = [
+    '-- _IranintlTV',
+    '@VahidOnline@ 👇',
+    '__Farsi_Iranwire__',
+]
+
+
+def make_corpus(count, seed=1):
+    # News-like messages: plain text, usually a link or two, a channel signature on some
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        parts = [rng.choice(WORDS) for _ in range(rng.randint(20, 120))]
+        for _ in range(rng.randint(0, 2)):
+            parts.insert(rng.randrange(len(parts)), rng.choice(JUNK))
+        if rng.random() < 0.15:
+            parts.append(rng.choice(SIGNATURES))
+        corpus.append(' '.join(parts))
+    return corpus
+
+
+def bench(fn, corpus, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(corpus)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark clean_text implementations')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.messages)
+    cleaner = TextCleaner()
+
+    mismatches = sum(1 for text in corpus if legacy_clean_text(text) != cleaner.clean(text))
+    legacy = bench(lambda texts: [legacy_clean_text(t) for t in texts], corpus, args.repeat)
+    engine = bench(cleaner.clean_batch, corpus, args.repeat)
+
+    print(f"messages:        {args.messages}")
+    print(f"legacy re.sub:   {legacy * 1000:.1f} ms ({legacy / args.messages * 1e6:.1f} us/msg)")
+    print(f"compiled engine: {engine * 1000:.1f} ms ({engine / args.messages * 1e6:.1f} us/msg)")
+    print(f"speedup:         {legacy / engine:.2f}x")
+    print(f"output mismatches vs legacy: {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
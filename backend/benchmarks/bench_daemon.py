@@ -0,0 +1,134 @@
+# Live-update latency benchmark for main.py --daemon, without Telegram credentials.
+# Runs the normal catch-up pass against FakeTelegramClient, then pushes new posts
+# (and a few edits) through the fake client's event handlers and measures how long
+# each takes to show up in the exported feed. The cron baseline for comparison is
+# the schedule interval plus a full run.
+#
+# Usage: python backend/benchmarks/bench_daemon.py [--updates 20 --interval 0.5 --flush-interval 1]
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_pipeline import setup  # noqa: E402
+from fake_telegram import FakeTelegramClient  # noqa: E402
+
+
+def feed_texts(output):
+    try:
+        with open(output, 'r', encoding='utf-8') as f:
+            return {item['id']: item['text'] for item in json.load(f)}
+    except (OSError, ValueError):
+        return {}
+
+
+async def drive(main, output, args):
+    clients = []
+
+    def make_client(*a, **kw):
+        client = FakeTelegramClient(*a, **kw)
+        clients.append(client)
+        return client
+
+    main.TelegramClient = make_client
+    daemon = asyncio.create_task(main.main())
+    # The catch-up run is over once the daemon has subscribed
+    while not (clients and clients[0].handlers):
+        if daemon.done():
+            raise RuntimeError('main() exited before subscribing')
+        await asyncio.sleep(0.05)
+    client = clients[0]
+
+    rng = random.Random(11)
+    photos = sorted(glob.glob(os.path.join(args.workdir, 'dataset', 'corpus', 'photo_*.jpg')))
+    sent = {}
+    latencies = {}
+    sending = True
+
+    async def watch_feed():
+        # Polls the exported feed while updates are still being pushed
+        while sending or (len(latencies) < len(sent) and time.perf_counter() < timeout):
+            texts = feed_texts(output)
+            now = time.perf_counter()
+            for item_id, (text, started) in list(sent.items()):
+                if item_id not in latencies and texts.get(item_id) == text:
+                    latencies[item_id] = now - started
+            await asyncio.sleep(0.05)
+
+    timeout = float('inf')
+    watcher = asyncio.create_task(watch_feed())
+    for n in range(args.updates):
+        channel = rng.choice(sorted(client.channels))
+        edited = n % 5 == 4 and client.channels[channel]
+        if edited:
+            raw = dict(client.channels[channel][-1], text=f'edited post {n}')
+        else:
+            raw = {
+                'id': client.channels[channel][-1]['id'] + 1,
+                'date': datetime.now(timezone.utc).isoformat(),
+                'text': f'live post {n}',
+                'media': {'kind': 'photo', 'id': 900_000 + n, 'file': rng.choice(photos)} if photos and rng.random() < args.photo_ratio else None,
+            }
+        sent[f"{channel}_{raw['id']}"] = (raw['text'], time.perf_counter())
+        await client.emit(channel, raw, edited=bool(edited))
+        await asyncio.sleep(args.interval)
+
+    timeout = time.perf_counter() + args.flush_interval + 60
+    sending = False
+    await watcher
+
+    main.STOP_REQUESTED = True
+    await daemon
+    return latencies, len(sent)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Daemon live-update latency benchmark')
+    parser.add_argument('--workdir', default='/tmp/news_bench_daemon')
+    parser.add_argument('--channels', type=int, default=10)
+    parser.add_argument('--existing', type=int, default=1000)
+    parser.add_argument('--updates', type=int, default=20)
+    parser.add_argument('--interval', type=float, default=0.5, help='Seconds between pushed updates')
+    parser.add_argument('--flush-interval', type=float, default=1.0)
+    parser.add_argument('--photo-ratio', type=float, default=0.3)
+    parser.add_argument('--cron-interval', type=float, default=300, help='Polling schedule the daemon replaces')
+    args = parser.parse_args()
+    args.workdir = os.path.abspath(args.workdir)
+
+    # Dataset/setup options shared with bench_pipeline. Always fresh: ids pushed
+    # by an earlier run would already be in the feed.
+    args.fresh = True
+    args.new = 0
+    args.video_ratio = 0.0
+    args.album_ratio = 0.0
+    args.repost_ratio = 0.0
+    args.latency = 0.0
+    args.flood_rate = 0.0
+    args.limit = 100
+    args.max_duration = 250
+    args.main_args = ['--daemon', '--flush-interval', str(args.flush_interval)]
+    main_module, output = setup(args)
+
+    started = time.perf_counter()
+    latencies, sent = asyncio.run(drive(main_module, output, args))
+    wall = time.perf_counter() - started
+
+    values = sorted(latencies.values())
+    print(f"\nupdates delivered: {len(values)}/{sent} (wall {wall:.1f}s)")
+    if values:
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(f"latency: median {statistics.median(values):.2f}s  p95 {p95:.2f}s  max {values[-1]:.2f}s")
+    print(f"cron baseline: up to {args.cron_interval:.0f}s + one full run (median ~{args.cron_interval / 2:.0f}s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+# End-to-end pipeline benchmark without Telegram credentials.
+# Generates a synthetic dataset, seeds the state store with "existing" items,
+# runs main() against FakeTelegramClient and reports per-phase timings,
+# peak RSS and files written.
+#
+# Usage: python backend/benchmarks/bench_pipeline.py [--channels 50 --existing 10000 --new 500]
+#        [--latency 0.02] [--runs 2] [--workdir /tmp/bench] [--report report.json]
+import argparse
+import asyncio
+import functools
+import json
+import os
+import resource
+import shutil
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_telegram import FakeTelegramClient, make_dataset  # noqa: E402
+
+
+class PhaseTimer:
+    # Cumulative time per wrapped function. Concurrent calls overlap, so the
+    # sum can exceed the wall time of the run.
+    def __init__(self):
+        self.phases = {}
+
+    def record(self, name, elapsed):
+        calls, total = self.phases.get(name, (0, 0.0))
+        self.phases[name] = (calls + 1, total + elapsed)
+
+    def wrap(self, owner, attr, name=None):
+        fn = getattr(owner, attr)
+        name = name or attr
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+        else:
+            @functools.wraps(fn)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+        setattr(owner, attr, timed)
+
+    def reset(self):
+        self.phases = {}
+
+
+def dir_stats(path):
+    count = size = 0
+    for entry in os.scandir(path):
+        if entry.is_file():
+            count += 1
+            size += entry.stat().st_size
+    return count, size
+
+
+def peak_rss_mb():
+    self_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return self_kb / 1024, children_kb / 1024
+
+
+def setup(args):
+    workdir = os.path.abspath(args.workdir)
+    if args.fresh and os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    dataset_dir = os.path.join(workdir, 'dataset')
+    feed_dir = os.path.join(workdir, 'feed')
+    os.makedirs(feed_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    _, existing_items = make_dataset(
+        dataset_dir, channels=args.channels, existing=args.existing, new=args.new,
+        photo_ratio=args.photo_ratio, video_ratio=args.video_ratio, album_ratio=args.album_ratio,
+        repost_ratio=args.repost_ratio,
+    )
+    print(f"dataset: {args.channels} channels, {len(existing_items)} existing items "
+          f"({time.perf_counter() - start:.1f}s to generate)")
+
+    output = os.path.join(feed_dir, 'news.json')
+    os.environ.setdefault('TELEGRAM_API_ID', '1')
+    os.environ.setdefault('TELEGRAM_API_HASH', 'bench')
+    os.environ.setdefault('TELEGRAM_SESSION', 'bench')
+    import main
+    main.configure([
+        '--channels', os.path.join(dataset_dir, 'channels.txt'), '--output', output,
+        '--limit', str(args.limit), '--max-duration', str(args.max_duration),
+    ] + args.main_args)
+
+    main.MEDIA_DIR = os.path.join(feed_dir, 'media')
+    os.makedirs(main.MEDIA_DIR, exist_ok=True)
+    FakeTelegramClient.dataset_path = os.path.join(dataset_dir, 'dataset.json')
+    FakeTelegramClient.latency = args.latency
+    FakeTelegramClient.flood_rate = args.flood_rate
+    main.TelegramClient = FakeTelegramClient
+    main.StringSession = lambda session: session
+
+    # Seed the store as if earlier runs had produced the existing items
+    store = main.StateStore(main.state_path_for(output))
+    if store.is_empty():
+        store.import_items(existing_items)
+    store.close()
+    return main, output
+
+
+def instrument(main, timer):
+    for attr in ('fetch_channel_news', 'download_media', 'compress_image', 'run_ffmpeg',
+                 'take_within_budget', 'write_feed', 'write_sharded', 'cluster_items', 'update_search_index'):
+        timer.wrap(main, attr)
+    import video_transcode
+    timer.wrap(video_transcode, 'probe_video', 'ffprobe')
+    for attr in ('upsert_items', 'high_water_marks', 'delete_after'):
+        timer.wrap(main.StateStore, attr, f'store.{attr}')
+    for attr in ('oversized', 'iter_lru', 'remove_files', 'track_files', 'rebuild_files'):
+        timer.wrap(main.MediaIndex, attr, f'media_index.{attr}')
+
+
+def run_once(main, output, timer, label):
+    timer.reset()
+    media_before = dir_stats(main.MEDIA_DIR)
+    start = time.perf_counter()
+    asyncio.run(main.main())
+    wall = time.perf_counter() - start
+    media_after = dir_stats(main.MEDIA_DIR)
+    self_rss, child_rss = peak_rss_mb()
+    result = {
+        'label': label,
+        'wall_seconds': round(wall, 3),
+        'peak_rss_mb': round(self_rss, 1),
+        'peak_child_rss_mb': round(child_rss, 1),
+        'media_files_written': media_after[0] - media_before[0],
+        'media_bytes_written': media_after[1] - media_before[1],
+        'feed_bytes': os.path.getsize(output) if os.path.exists(output) else 0,
+        'phases': {name: {'calls': calls, 'seconds': round(total, 4)}
+                   for name, (calls, total) in sorted(timer.phases.items(), key=lambda kv: -kv[1][1])},
+    }
+    # main.py's own run report (phases, counters, per-channel stats)
+    report_path = main.report_path_for(output)
+    if os.path.exists(report_path):
+        with open(report_path, 'r', encoding='utf-8') as f:
+            result['run_report'] = json.load(f)
+    return result
+
+
+def print_result(result):
+    print(f"\n=== {result['label']} ===")
+    print(f"wall: {result['wall_seconds']:.2f}s  peak RSS: {result['peak_rss_mb']:.0f} MB "
+          f"(children {result['peak_child_rss_mb']:.0f} MB)")
+    print(f"media written: {result['media_files_written']} files, "
+          f"{result['media_bytes_written'] / (1024 * 1024):.1f} MB  feed: {result['feed_bytes'] / 1024:.0f} KB")
+    print(f"{'phase':<32}{'calls':>8}{'seconds':>12}")
+    for name, phase in result['phases'].items():
+        print(f"{name:<32}{phase['calls']:>8}{phase['seconds']:>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline pipeline benchmark')
+    parser.add_argument('--workdir', default='/tmp/news_bench')
+    parser.add_argument('--channels', type=int, default=50)
+    parser.add_argument('--existing', type=int, default=10000)
+    parser.add_argument('--new', type=int, default=500)
+    parser.add_argument('--photo-ratio', type=float, default=0.3)
+    parser.add_argument('--video-ratio', type=float, default=0.05)
+    parser.add_argument('--album-ratio', type=float, default=0.0, help='Share of new messages that start an album')
+    parser.add_argument('--repost-ratio', type=float, default=0.0, help='Share of new messages that repeat another channel\'s post')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds per fake RPC')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='Probability of a FloodWait per RPC')
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--max-duration', type=int, default=250)
+    parser.add_argument('--runs', type=int, default=2, help='Second and later runs measure the no-new-items path')
+    parser.add_argument('--fresh', action='store_true', help='Delete the workdir first')
+    parser.add_argument('--report', help='Write the results as JSON to this path')
+    parser.add_argument('main_args', nargs='*', help='Extra arguments passed to main.py (after --)')
+    args = parser.parse_args()
+
+    main_module, output = setup(args)
+    timer = PhaseTimer()
+    instrument(main_module, timer)
+
+    results = []
+    for i in range(args.runs):
+        result = run_once(main_module, output, timer, 'run 1 (new items)' if i == 0 else f'run {i + 1} (no-op)')
+        print_result(result)
+        results.append(result)
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
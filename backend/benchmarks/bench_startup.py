@@ -0,0 +1,87 @@
+# Start-up benchmark for the cron path, without Telegram credentials.
+# 1. Import cost: `import main` in a fresh interpreter, and the heavy modules it now
+#    defers (Telethon, Pillow, the process pool) imported on their own.
+# 2. No-op runs: after one run that fetches everything, main() is run again with no
+#    new posts, with the pre-check and with --no-precheck, against FakeTelegramClient.
+#
+# Usage: python backend/benchmarks/bench_startup.py [--repeat 5 --channels 20 --existing 2000 --latency 0.02]
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_pipeline import setup  # noqa: E402
+
+DEFERRED = 'import telethon, telethon.sessions, telethon.tl.functions.channels, PIL.Image, concurrent.futures.process'
+
+
+def python_seconds(code, repeat):
+    # Median wall time of a fresh interpreter running code from the backend directory
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], cwd=BACKEND_DIR, check=True)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def loaded_heavy_modules():
+    out = subprocess.run(
+        [sys.executable, '-c', "import sys, main; print(' '.join(m for m in ('telethon', 'PIL', 'concurrent.futures.process') if m in sys.modules))"],
+        cwd=BACKEND_DIR, check=True, capture_output=True, text=True,
+    )
+    return out.stdout.split()
+
+
+def timed_run(main_module, precheck):
+    main_module.args.no_precheck = not precheck
+    start = time.perf_counter()
+    asyncio.run(main_module.main())
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time and no-op start-up benchmark')
+    parser.add_argument('--workdir', default='/tmp/news_bench_startup')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--existing', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds per fake RPC')
+    args = parser.parse_args()
+
+    baseline = python_seconds('pass', args.repeat)
+    import_main = python_seconds('import main', args.repeat)
+    deferred = python_seconds(DEFERRED, args.repeat)
+    print(f"interpreter start:          {baseline:.3f}s")
+    print(f"import main:                {import_main - baseline:.3f}s (heavy modules loaded: {', '.join(loaded_heavy_modules()) or 'none'})")
+    print(f"deferred heavy imports:     {deferred - baseline:.3f}s (Telethon, Pillow, process pool)")
+
+    # Dataset/setup options shared with bench_pipeline
+    args.fresh = True
+    args.new = 0
+    args.photo_ratio = 0.3
+    args.video_ratio = 0.0
+    args.album_ratio = 0.0
+    args.repost_ratio = 0.0
+    args.flood_rate = 0.0
+    args.limit = 100
+    args.max_duration = 250
+    args.main_args = []
+    main_module, _ = setup(args)
+    timed_run(main_module, precheck=True)
+
+    full = [timed_run(main_module, precheck=False) for _ in range(args.repeat)]
+    skipped = [timed_run(main_module, precheck=True) for _ in range(args.repeat)]
+    print(f"\nno-op run, full fetch:      {statistics.median(full):.3f}s")
+    print(f"no-op run, pre-check exit:  {statistics.median(skipped):.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+# Offline stand-in for telethon's TelegramClient, used by the benchmarks.
+# Serves synthetic channels/messages from a dataset directory written by
+# make_dataset(); media bytes come from a small corpus of real JPEG/MP4 files.
+import asyncio
+import json
+import os
+import random
+import shutil
+import subprocess
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from telethon import events
+from telethon.errors import FloodWaitError
+from telethon.tl.types import InputPeerChannel, MessageEntityTextUrl
+
+WORDS = ['خبر', 'فوری', 'تهران', 'گزارش', 'امروز', 'اعتراض', 'دولت', 'news', 'update', 'iran', '۱۴۰۳']
+# Most words are story specific; with only the common ones every text would look like a near-duplicate
+TOPIC_WORDS = [f'{WORDS[i % len(WORDS)]}{i}' for i in range(5000)]
+JUNK = ['https://example.com/a?b=%20c', '[ bbc.com ]', '( https://t.me/x/1 )', '\n\n\n']
+BASE_DATE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+# --- Dataset ---
+
+def make_corpus(corpus_dir, photos=8, videos=2, video_seconds=3):
+    # A few real media files; messages point at them round-robin
+    from PIL import Image
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng = random.Random(7)
+    photo_files = []
+    for i in range(photos):
+        path = os.path.join(corpus_dir, f'photo_{i}.jpg')
+        if not os.path.exists(path):
+            w, h = rng.choice([(1600, 900), (1280, 1280), (800, 600), (2048, 1536)])
+            img = Image.effect_noise((w, h), 40 + i * 5).convert('RGB')
+            img.save(path, 'JPEG', quality=90)
+        photo_files.append(path)
+
+    video_files = []
+    if videos and shutil.which('ffmpeg'):
+        for i in range(videos):
+            path = os.path.join(corpus_dir, f'video_{i}.mp4')
+            if not os.path.exists(path):
+                subprocess.run([
+                    'ffmpeg', '-y', '-f', 'lavfi', '-i', f'testsrc=duration={video_seconds}:size=1280x720:rate=30',
+                    '-f', 'lavfi', '-i', f'sine=frequency={440 + i * 110}:duration={video_seconds}',
+                    '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest', path,
+                ], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            video_files.append(path)
+    return photo_files, video_files
+
+
+def make_text(rng):
+    parts = [rng.choice(WORDS) if rng.random() < 0.15 else rng.choice(TOPIC_WORDS) for _ in range(rng.randint(15, 90))]
+    if rng.random() < 0.5:
+        parts.insert(rng.randrange(len(parts)), rng.choice(JUNK))
+    return ' '.join(parts)
+
+
+def make_dataset(dataset_dir, channels=50, existing=10000, new=500, photo_ratio=0.3, video_ratio=0.05,
+                 photos=8, videos=2, seed=1, album_ratio=0.0, repost_ratio=0.0):
+    # Writes dataset.json (channels with their messages) and channels.txt.
+    # album_ratio of the new messages start an album: 2-5 photos sharing a grouped_id,
+    # captioned on the first one only. repost_ratio of the new messages repeat the
+    # previous channel's post of the same minute, with the channel's hashtag added.
+    # Returns (dataset, existing_items): the latter is what an earlier run would have stored.
+    rng = random.Random(seed)
+    photo_files, video_files = make_corpus(os.path.join(dataset_dir, 'corpus'), photos, videos)
+    names = [f'bench_channel_{i:02d}' for i in range(channels)]
+    existing_per = max(1, existing // channels)
+    new_per = max(0, new // channels)
+
+    dataset = {'channels': {}}
+    existing_items = []
+    doc_id = 10_000
+    for ci, name in enumerate(names):
+        messages = []
+        album_left = 0
+        for msg_id in range(1, existing_per + new_per + 1):
+            if album_left:
+                album_left -= 1
+                date = datetime.fromisoformat(messages[-1]['date'])
+                doc_id += 1
+                messages.append({'id': msg_id, 'date': date.isoformat(), 'text': '', 'grouped_id': messages[-1]['grouped_id'],
+                                 'media': {'kind': 'photo', 'id': doc_id, 'file': rng.choice(photo_files)}})
+                continue
+            date = BASE_DATE + timedelta(minutes=msg_id * channels + ci)
+            msg = {'id': msg_id, 'date': date.isoformat(), 'text': make_text(rng), 'media': None}
+            roll = rng.random()
+            doc_id += 1
+            if roll < video_ratio and video_files:
+                msg['media'] = {'kind': 'video', 'id': doc_id, 'file': rng.choice(video_files)}
+            elif roll < video_ratio + photo_ratio:
+                msg['media'] = {'kind': 'photo', 'id': doc_id, 'file': rng.choice(photo_files)}
+            if rng.random() < 0.2:
+                msg['link'] = f'https://example.com/{name}/{msg_id}'
+            if repost_ratio and ci and msg_id > existing_per and rng.random() < repost_ratio:
+                original = dataset['channels'][names[ci - 1]][msg_id - 1]
+                if original['text']:
+                    msg['text'] = f"{original['text']} #{name}"
+            if album_ratio and msg_id > existing_per and rng.random() < album_ratio:
+                doc_id += 1
+                msg['media'] = {'kind': 'photo', 'id': doc_id, 'file': rng.choice(photo_files)}
+                msg['grouped_id'] = doc_id
+                album_left = rng.randint(1, 4)
+            messages.append(msg)
+            if msg_id <= existing_per:
+                existing_items.append({
+                    'id': f'{name}_{msg_id}', 'source': name, 'text': msg['text'], 'date': msg['date'],
+                    'link': f'https://t.me/{name}/{msg_id}', 'media': None, 'mediaType': None,
+                    'poster': None, 'sensitive': False,
+                })
+        dataset['channels'][name] = messages
+
+    os.makedirs(dataset_dir, exist_ok=True)
+    with open(os.path.join(dataset_dir, 'dataset.json'), 'w', encoding='utf-8') as f:
+        json.dump(dataset, f, ensure_ascii=False)
+    with open(os.path.join(dataset_dir, 'channels.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(names) + '\n')
+    return dataset, existing_items
+
+
+# --- Fake client ---
+
+def build_message(channel, raw):
+    media = None
+    spec = raw.get('media')
+    if spec:
+        size = os.path.getsize(spec['file'])
+        if spec['kind'] == 'video':
+            document = SimpleNamespace(id=spec['id'], size=size, mime_type='video/mp4',
+                                       attributes=[SimpleNamespace(duration=3, w=1280, h=720)], path=spec['file'])
+            media = SimpleNamespace(document=document, spoiler=False)
+        else:
+            media = SimpleNamespace(photo=SimpleNamespace(id=spec['id'], path=spec['file']), spoiler=False)
+    text = raw['text']
+    entities = None
+    if raw.get('link'):
+        entities = [MessageEntityTextUrl(offset=0, length=1, url=raw['link'])]
+    return SimpleNamespace(
+        id=raw['id'], text=text, message=text, media=media, entities=entities,
+        date=datetime.fromisoformat(raw['date']), grouped_id=raw.get('grouped_id'),
+        chat_id=channel, peer_id=channel,
+    )
+
+
+def media_path(message):
+    media = message.media
+    if hasattr(media, 'document'):
+        return media.document.path
+    return media.photo.path
+
+
+class FakeTelegramClient:
+    # Configurable per-request latency (seconds) and FloodWait probability
+    latency = 0.0
+    flood_rate = 0.0
+    dataset_path = None
+
+    def __init__(self, *args, **kwargs):
+        with open(self.dataset_path, 'r', encoding='utf-8') as f:
+            self.channels = json.load(f)['channels']
+        self.rng = random.Random(3)
+        self.requests = 0
+        self.resolves = 0
+        # Stable ids/access hashes per channel, as Telegram hands them out
+        self.peers = {name: InputPeerChannel(channel_id=1_000_000 + i, access_hash=7_000_000 + i)
+                      for i, name in enumerate(sorted(self.channels))}
+        self.names_by_id = {peer.channel_id: name for name, peer in self.peers.items()}
+        self.handlers = []
+        self.edits = {}
+        self.flood_sleep_threshold = 60
+
+    async def _rpc(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_rate and self.rng.random() < self.flood_rate:
+            raise FloodWaitError(request=None, capture=1)
+
+    async def __call__(self, request):
+        # Only channels.GetFullChannelRequest (the start-up pre-check) is sent as a raw request
+        await self._rpc()
+        name = self._channel(request.channel)
+        # pts moves with every new or edited message
+        pts = sum(raw['id'] for raw in self.channels[name][-1:]) + self.edits.get(name, 0)
+        return SimpleNamespace(full_chat=SimpleNamespace(pts=pts))
+
+    async def start(self):
+        await self._rpc()
+        return self
+
+    async def connect(self):
+        await self._rpc()
+
+    async def disconnect(self):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def _channel(self, entity):
+        if isinstance(entity, InputPeerChannel):
+            return self.names_by_id[entity.channel_id]
+        return entity
+
+    async def get_input_entity(self, target):
+        if isinstance(target, InputPeerChannel):
+            # Input peers are used as is, without a request
+            return target
+        await self._rpc()
+        self.resolves += 1
+        name = target if isinstance(target, str) else getattr(target, 'username', None) or str(target)
+        if name not in self.channels:
+            raise ValueError(f'No user has "{name}" as username')
+        return self.peers[name]
+
+    def add_event_handler(self, callback, event):
+        self.handlers.append((callback, event))
+
+    def remove_event_handler(self, callback, event=None):
+        self.handlers = [(cb, ev) for cb, ev in self.handlers if cb is not callback]
+
+    async def emit(self, channel, raw, edited=False):
+        # Delivers a live update like Telegram would: the message is stored, then
+        # NewMessage (or MessageEdited) handlers run. Chat filters are not applied.
+        messages = self.channels[channel]
+        if edited:
+            messages[:] = [raw if m['id'] == raw['id'] else m for m in messages]
+            self.edits[channel] = self.edits.get(channel, 0) + 1
+        else:
+            messages.append(raw)
+        message = build_message(channel, raw)
+        message.peer_id = self.peers[channel]
+        wanted = events.MessageEdited if edited else events.NewMessage
+        for callback, event in list(self.handlers):
+            if type(event) is wanted:
+                await callback(SimpleNamespace(message=message))
+
+    async def iter_dialogs(self, limit=None, **kwargs):
+        # The account is subscribed to every channel of the dataset
+        for i, name in enumerate(sorted(self.channels)[:limit]):
+            if i % 100 == 0:
+                await self._rpc()
+            peer = self.peers[name]
+            yield SimpleNamespace(entity=SimpleNamespace(id=peer.channel_id, access_hash=peer.access_hash, username=name))
+
+    async def iter_messages(self, entity, limit=None, min_id=0, max_id=0, **kwargs):
+        entity = self._channel(entity)
+        messages = self.channels[entity]
+        batch = 0
+        count = 0
+        for raw in reversed(messages):
+            if max_id and raw['id'] >= max_id:
+                continue
+            if raw['id'] <= min_id or (limit is not None and count >= limit):
+                break
+            if batch == 0:
+                await self._rpc()
+            batch = (batch + 1) % 100
+            count += 1
+            yield build_message(entity, raw)
+
+    async def get_messages(self, entity, ids=None, limit=None, **kwargs):
+        await self._rpc()
+        entity = self._channel(entity)
+        by_id = {raw['id']: raw for raw in self.channels[entity]}
+        if ids is None:
+            newest = list(reversed(self.channels[entity]))[:limit or 1]
+            return [build_message(entity, raw) for raw in newest]
+        single = isinstance(ids, int)
+        found = [build_message(entity, by_id[i]) if i in by_id else None for i in ([ids] if single else ids)]
+        return found[0] if single else found
+
+    async def download_media(self, message, file=None, thumb=None):
+        await self._rpc()
+        if not message.media:
+            return None
+        src = media_path(message)
+        if thumb is not None:
+            if hasattr(message.media, 'document'):
+                return None  # no Telegram thumb: exercises the ffmpeg poster fallback
+            ext = '.jpg'
+        else:
+            ext = os.path.splitext(src)[1]
+        dst = file if os.path.splitext(file)[1] else file + ext
+        shutil.copyfile(src, dst)
+        return dst
+
+    async def iter_download(self, file, offset=0, request_size=512 * 1024, limit=None, file_size=None, **kwargs):
+        with open(file.path, 'rb') as f:
+            f.seek(offset)
+            sent = 0
+            while limit is None or sent < limit:
+                await self._rpc()
+                chunk = f.read(request_size)
+                if not chunk:
+                    break
+                sent += 1
+                yield chunk
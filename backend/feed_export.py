@@ -0,0 +1,53 @@
+# Size-accounted feed serializer.
+# Produces byte-for-byte the same file as json.dump(items, f, ensure_ascii=False, indent=2),
+# but encodes every item only once and picks the size cutoff in a single pass.
+import json
+
+from atomic_io import atomic_open
+
+LIST_OPEN = b'[\n'
+LIST_CLOSE = b'\n]'
+SEPARATOR = b',\n'
+
+
+def encode_feed_item(item):
+    # An item as it appears inside the top-level list: indented one level (2 spaces).
+    # String values never contain raw newlines (json escapes them), so re-indenting lines is exact.
+    text = json.dumps(item, ensure_ascii=False, indent=2)
+    return ('  ' + text.replace('\n', '\n  ')).encode('utf-8')
+
+
+def feed_size(payload_bytes, count):
+    if count == 0:
+        return len(b'[]')
+    return len(LIST_OPEN) + payload_bytes + len(SEPARATOR) * (count - 1) + len(LIST_CLOSE)
+
+
+def take_within_budget(items, max_bytes):
+    # Consumes items (newest first) until the next one would push the on-disk size over max_bytes.
+    # Returns (kept, chunks, truncated); the input is only read as far as needed.
+    kept = []
+    chunks = []
+    payload = 0
+    for item in items:
+        chunk = encode_feed_item(item)
+        if feed_size(payload + len(chunk), len(chunks) + 1) > max_bytes:
+            return kept, chunks, True
+        kept.append(item)
+        chunks.append(chunk)
+        payload += len(chunk)
+    return kept, chunks, False
+
+
+def write_feed(path, chunks):
+    # Streams pre-encoded items to disk; the old file stays in place until the new one is complete
+    with atomic_open(path, 'wb') as f:
+        if not chunks:
+            f.write(b'[]')
+            return
+        f.write(LIST_OPEN)
+        for i, chunk in enumerate(chunks):
+            if i:
+                f.write(SEPARATOR)
+            f.write(chunk)
+        f.write(LIST_CLOSE)
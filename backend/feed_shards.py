@@ -0,0 +1,162 @@
+# Sharded feed output.
+# Next to (or instead of) the monolithic feed JSON, writes a directory with:
+#   latest.json    the newest LATEST_COUNT items, enough for the first screen
+#   shards/*.json  every exported item, bucketed by UTC day (split by size when a day is large)
+#   manifest.json  shard ranges plus a content hash (ETag) per file
+# Encoding is deterministic, so a shard whose items didn't change keeps the same
+# bytes and hash, and isn't rewritten; clients and CDNs can keep caching it.
+import datetime
+import hashlib
+import json
+import os
+
+from atomic_io import atomic_write
+
+LATEST_COUNT = 100
+SHARD_MAX_BYTES = 512 * 1024
+LATEST_NAME = 'latest.json'
+MANIFEST_NAME = 'manifest.json'
+SHARDS_SUBDIR = 'shards'
+MANIFEST_VERSION = 1
+
+
+def shard_dir_for(output):
+    # "news.json" -> "news/"
+    base, _ = os.path.splitext(output)
+    return base
+
+
+def manifest_path_for(output):
+    return os.path.join(shard_dir_for(output), MANIFEST_NAME)
+
+
+def encode_compact(item):
+    return json.dumps(item, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def encode_list(chunks):
+    return b'[' + b','.join(chunks) + b']'
+
+
+def etag(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def item_day(item):
+    # Dates are UTC ISO strings, so the first 10 characters are the day
+    return item['date'][:10]
+
+
+def plan_shards(items, chunks):
+    # items/chunks are newest first. Each day is packed oldest first, so new items
+    # of the current day only ever change that day's last part.
+    days = {}
+    for item, chunk in zip(items, chunks):
+        days.setdefault(item_day(item), []).append((item, chunk))
+
+    shards = []
+    for day, day_items in days.items():
+        parts = [[]]
+        size = 0
+        for entry in reversed(day_items):
+            if parts[-1] and size + len(entry[1]) + 1 > SHARD_MAX_BYTES:
+                parts.append([])
+                size = 0
+            parts[-1].append(entry)
+            size += len(entry[1]) + 1
+        day_shards = []
+        for n, part in enumerate(parts):
+            part.reverse()
+            day_shards.append({
+                'file': f"{SHARDS_SUBDIR}/{day}.json" if n == 0 else f"{SHARDS_SUBDIR}/{day}.{n}.json",
+                'day': day,
+                'count': len(part),
+                'newest': part[0][0]['date'],
+                'oldest': part[-1][0]['date'],
+                'data': encode_list([chunk for _, chunk in part]),
+            })
+        # Manifest lists shards newest first, like the feed
+        shards.extend(reversed(day_shards))
+    return shards
+
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return manifest if is_manifest(manifest) else None
+    except (OSError, ValueError):
+        return None
+
+
+def is_manifest(data):
+    return isinstance(data, dict) and 'shards' in data and 'latest' in data
+
+
+def manifest_files(manifest):
+    return [manifest['latest']['file']] + [shard['file'] for shard in manifest['shards']]
+
+
+def write_sharded(out_dir, items, latest_count=LATEST_COUNT):
+    # Writes latest.json, the shards and the manifest for items (newest first).
+    # Returns (files_written, bytes_written); unchanged files are left alone.
+    os.makedirs(os.path.join(out_dir, SHARDS_SUBDIR), exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    previous = load_manifest(manifest_path)
+    previous_etags = {}
+    if previous:
+        previous_etags[previous['latest']['file']] = previous['latest']['etag']
+        for shard in previous['shards']:
+            previous_etags[shard['file']] = shard['etag']
+
+    chunks = [encode_compact(item) for item in items]
+    files = [{'file': LATEST_NAME, 'count': min(latest_count, len(items)), 'data': encode_list(chunks[:latest_count])}]
+    files.extend(plan_shards(items, chunks))
+
+    written = 0
+    written_bytes = 0
+    for entry in files:
+        data = entry.pop('data')
+        entry['bytes'] = len(data)
+        entry['etag'] = etag(data)
+        path = os.path.join(out_dir, entry['file'])
+        if previous_etags.get(entry['file']) == entry['etag'] and os.path.exists(path):
+            continue
+        atomic_write(path, data)
+        written += 1
+        written_bytes += len(data)
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'generated_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'total': len(items),
+        'latest': files[0],
+        'shards': files[1:],
+    }
+    # The manifest goes last so it never points at a shard that isn't there yet
+    data = json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+    atomic_write(manifest_path, data)
+    written += 1
+    written_bytes += len(data)
+
+    # Shards no longer listed (evicted days, merged parts) are removed afterwards
+    live = set(manifest_files(manifest))
+    shards_dir = os.path.join(out_dir, SHARDS_SUBDIR)
+    for name in os.listdir(shards_dir):
+        if f"{SHARDS_SUBDIR}/{name}" not in live:
+            os.remove(os.path.join(shards_dir, name))
+    return written, written_bytes
+
+
+def read_sharded_items(manifest_path):
+    # Every item referenced by a manifest (the shards hold the full set)
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if not is_manifest(manifest):
+        raise ValueError(f"{manifest_path} is not a feed manifest")
+    items = []
+    out_dir = os.path.dirname(manifest_path)
+    for shard in manifest['shards']:
+        with open(os.path.join(out_dir, shard['file']), 'r', encoding='utf-8') as f:
+            items.extend(json.load(f))
+    return items
@@ -1,125 +1,310 @@
 import os
 import json
 import asyncio
-import re
+import hashlib
 from datetime import datetime
-from telethon import TelegramClient
-from telethon.sessions import StringSession
-from telethon.tl.types import MessageEntityTextUrl, InputPeerChannel
 import argparse
 import signal
 import time
 
+from text_cleaner import CleaningRules
+from state_store import StateStore, state_path_for
+from feed_export import encode_feed_item, take_within_budget, write_feed
+from feed_shards import manifest_path_for, shard_dir_for, write_sharded
+from media_index import MediaIndex, index_path_for, work_dir_for, media_key, file_stem_for_key, url_to_path, variant_urls
+from media_gc import collect_garbage, find_feed_files
+from resumable_download import download_resumable, DownloadInterrupted
+from run_metrics import RunMetrics, report_path_for
+from atomic_io import atomic_open, atomic_path, cleanup_temp_files
+from work_planner import WorkPlanner, ewma
+from near_dupes import cluster_items
+from search_index import search_dir_for, update_search_index
+from peer_cache import (cache_path_for, load_peer_cache, save_peer_cache, parse_channel_line,
+                        format_channel_line, resolve_channels)
+
+# Heavy modules are imported on first use: Telethon when a client is created (load_telegram),
+# Pillow, ffmpeg helpers and the process pool once a run has media work (load_media).
+# `gc` never imports Telethon, and a run with nothing new never starts the media pipeline.
+TelegramClient = None
+StringSession = None
+events = None
+MessageEntityTextUrl = None
+InputPeerChannel = None
+FloodWaitError = None
+ChannelInvalidError = None
+GetFullChannelRequest = None
+subprocess = None
+ProcessPoolExecutor = None
+media_workers = None
+video_transcode = None
+
 # Global flag for graceful exit
 STOP_REQUESTED = False
 DEBUG_ERRORS = []
+# Shared FloodWait gate: no channel starts a request before this timestamp
+FLOOD_WAIT_UNTIL = 0.0
+# Media pipeline: Pillow work goes to MEDIA_POOL, ffmpeg runs are capped by FFMPEG_SLOTS
+MEDIA_POOL = None
+FFMPEG_SLOTS = None
+# Shared media cache (see media_index.py) and per-key locks so one file is never processed twice at once
+MEDIA_INDEX = None
+MEDIA_KEY_LOCKS = {}
+# Global deadline of the run (set in main) and items whose media was cut off by it, keyed by item id
+RUN_DEADLINE = None
+INTERRUPTED_MEDIA = {}
+# Ids of items whose media download actually started this run (only those use up an attempt)
+MEDIA_ATTEMPTED = set()
+# Deadline planner for the current run, and media jobs deferred until every channel's text is in
+PLANNER = None
+DEFERRED_MEDIA = []
+# Channels whose cached access hash Telegram rejected this run
+STALE_PEERS = set()
+# Channels whose fetch failed, and channels whose recent posts were re-checked, this run
+FAILED_CHANNELS = set()
+RECHECKED_CHANNELS = set()
+# Channel -> (min_id, max_id, messages left) still to read below a cut run's items, None once read
+FETCH_GAPS = {}
+# item id -> (content hash, media key) of items built this run, saved with the items
+CONTENT_HASHES = {}
+RECHECK_BATCH = 100
+# Media retries per item before giving up on it
+MAX_MEDIA_ATTEMPTS = 5
+
+# Set by configure()
+args = None
+API_ID = API_HASH = SESSION_STRING = None
+CHANNELS_FILE = CLEAN_RULES_FILE = OUTPUT_FILE = MEDIA_DIR = None
+CLEANING_RULES = None
+# Formats of the responsive image variants written next to every JPEG (set by load_media)
+IMAGE_FORMATS = ()
+
+# Resolve paths
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 def signal_handler(sig, frame):
     global STOP_REQUESTED
     print(f"⚠️ Signal {sig} received. Stopping fetch to save progress...")
     STOP_REQUESTED = True
 
-signal.signal(signal.SIGINT, signal_handler)
-signal.signal(signal.SIGTERM, signal_handler)
-
 # --- Configuration ---
-parser = argparse.ArgumentParser(description='Fetch Telegram News')
-parser.add_argument('--channels', type=str, default='channels.txt', help='Path to channels list file')
-parser.add_argument('--output', type=str, default='news.json', help='Output JSON filename (relative to frontend/public)')
-parser.add_argument('--limit', type=int, default=50, help='Number of messages to check per channel')
-parser.add_argument('--max-duration', type=int, default=900, help='Max duration in seconds before stopping to save (Default: 900s)')
-args = parser.parse_args()
+def build_parser():
+    parser = argparse.ArgumentParser(description='Fetch Telegram News')
+    parser.add_argument('command', nargs='?', choices=['fetch', 'gc', 'resolve'], default='fetch', help="'fetch' (default), 'gc' to delete media no feed references, or 'resolve' to write Name|ID|Hash lines back to the channels file")
+    parser.add_argument('--channels', type=str, default='channels.txt', help='Path to channels list file')
+    parser.add_argument('--output', type=str, default='news.json', help='Output JSON filename (relative to frontend/public)')
+    parser.add_argument('--limit', type=int, default=50, help='Number of messages to check per channel')
+    parser.add_argument('--max-duration', type=int, default=900, help='Max duration in seconds before stopping to save (Default: 900s)')
+    parser.add_argument('--media-workers', type=int, default=4, help='Number of concurrent media downloads (Default: 4)')
+    parser.add_argument('--clean-rules', type=str, default='clean_rules.json', help='Optional JSON file with extra text-cleaning signatures, global and per channel')
+    parser.add_argument('--feeds', nargs='*', default=None, help='gc: feed JSON files sharing the media dir (Default: every feed JSON next to --output)')
+    parser.add_argument('--dry-run', action='store_true', help='gc: only report what would be deleted')
+    parser.add_argument('--gc-min-age', type=int, default=600, help='gc: never delete files younger than this many seconds (Default: 600)')
+    parser.add_argument('--output-mode', choices=['single', 'sharded', 'both'], default='single', help="'single' feed JSON (default), 'sharded' latest.json + day shards + manifest in a directory named after --output, or 'both'")
+    parser.add_argument('--image-formats', type=str, default='webp', help="Responsive image variant formats, comma separated (webp, avif); '' writes only the JPEG (Default: webp)")
+    parser.add_argument('--daemon', action='store_true', help='After the normal run, stay connected and apply new/edited posts live until stopped')
+    parser.add_argument('--flush-interval', type=float, default=10, help='Daemon: seconds to batch live updates before re-exporting the feed (Default: 10)')
+    parser.add_argument('--recheck-window', type=int, default=100, help='Re-check this many of each channel\'s newest stored posts for edits and deletions; 0 disables (Default: 100)')
+    parser.add_argument('--channel-concurrency', type=int, default=4, help='Max number of channels fetched at the same time (Default: 4)')
+    parser.add_argument('--no-precheck', action='store_true', help='Always run the full fetch, even when no channel changed since the last run')
+    return parser
 
-API_ID = os.environ.get("TELEGRAM_API_ID")
-API_HASH = os.environ.get("TELEGRAM_API_HASH")
-SESSION_STRING = os.environ.get("TELEGRAM_SESSION")
+def configure(argv=None):
+    # Parses the command line (sys.argv by default) and resolves credentials and paths
+    global args, API_ID, API_HASH, SESSION_STRING, CHANNELS_FILE, CLEAN_RULES_FILE, OUTPUT_FILE, MEDIA_DIR, CLEANING_RULES
+    args = build_parser().parse_args(argv)
 
-# Resolve paths
-# Resolve paths
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+    API_ID = os.environ.get("TELEGRAM_API_ID")
+    API_HASH = os.environ.get("TELEGRAM_API_HASH")
+    SESSION_STRING = os.environ.get("TELEGRAM_SESSION")
 
-# Channels file resolution
-if os.path.exists(args.channels):
-    CHANNELS_FILE = args.channels
-else:
-    CHANNELS_FILE = os.path.join(BASE_DIR, args.channels)
+    # Channels file resolution
+    if os.path.exists(args.channels):
+        CHANNELS_FILE = args.channels
+    else:
+        CHANNELS_FILE = os.path.join(BASE_DIR, args.channels)
 
-# Output file resolution
-if os.path.isabs(args.output):
-    OUTPUT_FILE = args.output
-else:
-    # If path starts with ../ or ./, treat as relative to CWD or BASE_DIR?
-    # Original logic forced relative to BASE_DIR. 
-    # Let's try to verify if we can write to CWD first.
-    # Actually, simplest match to previous logic:
-    OUTPUT_FILE = os.path.join(BASE_DIR, args.output)
+    if os.path.exists(args.clean_rules):
+        CLEAN_RULES_FILE = args.clean_rules
+    else:
+        CLEAN_RULES_FILE = os.path.join(BASE_DIR, args.clean_rules)
 
-MEDIA_DIR = os.path.join(BASE_DIR, '../media') if '..' in args.output else os.path.join(BASE_DIR, '../frontend/public/media')
+    # Output file resolution
+    if os.path.isabs(args.output):
+        OUTPUT_FILE = args.output
+    else:
+        # If path starts with ../ or ./, treat as relative to CWD or BASE_DIR?
+        # Original logic forced relative to BASE_DIR. 
+        # Let's try to verify if we can write to CWD first.
+        # Actually, simplest match to previous logic:
+        OUTPUT_FILE = os.path.join(BASE_DIR, args.output)
 
-# Simple fallback for media dir to be in root if output is in root
-if args.output.startswith('..'):
-    MEDIA_DIR = os.path.join(BASE_DIR, '../media')
+    MEDIA_DIR = os.path.join(BASE_DIR, '../media') if '..' in args.output else os.path.join(BASE_DIR, '../frontend/public/media')
 
-os.makedirs(MEDIA_DIR, exist_ok=True)
+    # Simple fallback for media dir to be in root if output is in root
+    if args.output.startswith('..'):
+        MEDIA_DIR = os.path.join(BASE_DIR, '../media')
 
+    # Compiled once; per-channel extras come from --clean-rules
+    CLEANING_RULES = CleaningRules.load(CLEAN_RULES_FILE)
 
-if not API_ID or not API_HASH:
-    print("Error: TELEGRAM_API_ID and TELEGRAM_API_HASH must be set.")
-    exit(1)
+def load_telegram():
+    # A TelegramClient/StringSession set beforehand (the benchmarks' fake client) is kept
+    global TelegramClient, StringSession, events, MessageEntityTextUrl, InputPeerChannel
+    global FloodWaitError, ChannelInvalidError, GetFullChannelRequest
+    import telethon
+    from telethon import events
+    from telethon.sessions import StringSession as string_session
+    from telethon.tl.types import MessageEntityTextUrl, InputPeerChannel
+    from telethon.errors import FloodWaitError, ChannelInvalidError
+    from telethon.tl.functions.channels import GetFullChannelRequest
+    if TelegramClient is None:
+        TelegramClient = telethon.TelegramClient
+    if StringSession is None:
+        StringSession = string_session
 
-def clean_text(text):
-    if not text:
-        return ""
-    # Remove markdown links [text](url)
-    text = re.sub(r'\[[^\]]+\]\(https?://[^\s)]+\)', '', text)
-    # Remove raw URLs in parentheses
-    text = re.sub(r'\(\s*https?://[^\s)]+\s*\)', '', text)
-    # Remove leftover brackets with domains or junk
-    text = re.sub(r'\[\s*[a-zA-Z0-9.-]+\.[a-z]{2,}\s*\]', '', text)
-    # Remove specific Telegram icons in brackets
-    text = re.sub(r'\[[📹📷🖼🎥]]', '', text)
-    # Remove standalone URLs
-    text = re.sub(r'https?://[^\s]+', '', text)
-    # Remove percent-encoded junk
-    text = re.sub(r'/%[0-9A-Fa-f]{2}', '', text)
-    text = re.sub(r'%[0-9A-Fa-f]{2}', '', text)
-    
-    # Remove specific signatures and junk
-    signatures = [
-        r'_+Farsi_Iranwire_+',
-        r'-- _IranintlTV',
-        r'VahidHeadline@ \W+',
-        r'VahidOnline@ \W+',
-        r'VahidOOnLine@ \W+',
-        r'VahidHeadline@',
-        r'VahidOnline@',
-        r'VahidOOnLine@'
-    ]
-    for sig in signatures:
-        text = re.sub(sig, '', text, flags=re.IGNORECASE)
-        
-    # Remove multiple newlines
-    text = re.sub(r'\n\s*\n', '\n\n', text)
-    return text.strip()
+def load_media():
+    global subprocess, ProcessPoolExecutor, media_workers, video_transcode, IMAGE_FORMATS
+    import subprocess
+    from concurrent.futures import ProcessPoolExecutor
+    import media_workers
+    import video_transcode
+    IMAGE_FORMATS = media_workers.supported_formats([fmt.strip() for fmt in args.image_formats.split(',') if fmt.strip()])
+
+def clean_text(text, channel_name=None):
+    return CLEANING_RULES.clean(text, channel_name)
 
+# Instrumentation for the current run (reset by main)
+METRICS = RunMetrics()
 
+def variants_for_item(variants):
+    # Worker result -> the item's 'imageVariants' field, one srcset string per format
+    if not variants:
+        return None
+    return {
+        'width': variants['width'],
+        'height': variants['height'],
+        'placeholder': variants['placeholder'],
+        'srcset': {fmt: ', '.join(f"/media/{name} {width}w" for name, width in files)
+                   for fmt, files in variants['files'].items()},
+    }
 
-from PIL import Image
+async def compress_image(src_path, dst_path, variant_stem=None):
+    # Pillow re-encode off the event loop (process pool, or the default executor if no pool is running).
+    # With variant_stem the responsive variants are rendered in the same job; returns them for the item.
+    loop = asyncio.get_running_loop()
+    formats = IMAGE_FORMATS if variant_stem else ()
+    with METRICS.phase('media.pillow'):
+        variants = await loop.run_in_executor(
+            MEDIA_POOL, media_workers.compress_image, src_path, dst_path,
+            media_workers.MAX_IMAGE_SIZE, media_workers.JPEG_QUALITY, variant_stem, formats,
+        )
+    variants = variants_for_item(variants)
+    METRICS.add('bytes_written', os.path.getsize(dst_path) + sum(
+        os.path.getsize(url_to_path(MEDIA_DIR, url)) for url in variant_urls(variants)))
+    return variants
 
-import subprocess
+async def existing_image_variants(path, variant_stem):
+    # Variants for a JPEG written by an earlier run (only missing files are rendered)
+    if not IMAGE_FORMATS or not variant_stem:
+        return None
+    loop = asyncio.get_running_loop()
+    try:
+        with METRICS.phase('media.pillow'):
+            variants = await loop.run_in_executor(MEDIA_POOL, media_workers.image_variants, path, variant_stem, IMAGE_FORMATS)
+    except Exception as e:
+        print(f"  Could not render image variants for {os.path.basename(path)}: {e}")
+        return None
+    return variants_for_item(variants)
+
+async def run_ffmpeg(cmd):
+    # Non-blocking replacement for subprocess.run(cmd, check=True)
+    slots = FFMPEG_SLOTS or asyncio.Semaphore(1)
+    async with slots:
+        with METRICS.phase('media.ffmpeg'):
+            proc = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                returncode = await proc.wait()
+            except asyncio.CancelledError:
+                proc.kill()
+                raise
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    if os.path.exists(cmd[-1]):
+        METRICS.add('bytes_written', os.path.getsize(cmd[-1]))
+
+def run_should_stop():
+    return STOP_REQUESTED or (RUN_DEADLINE is not None and time.time() > RUN_DEADLINE)
+
+async def download_video_file(client, message, path):
+    # Large documents go through the resumable, segmented downloader
+    document = getattr(message.media, 'document', None)
+    with METRICS.phase('media.download'):
+        if document is not None and getattr(document, 'size', 0):
+            v_path = await download_resumable(client, document, path, document.size, should_stop=run_should_stop)
+        else:
+            v_path = await client.download_media(message, file=path)
+    if v_path and os.path.exists(v_path):
+        METRICS.add('bytes_downloaded', os.path.getsize(v_path))
+    return v_path
 
-async def download_media(client, message, msg_id):
+def is_video_message(message):
+    if hasattr(message.media, 'document'):
+        mime = message.media.document.mime_type
+        return bool(mime and mime.startswith('video/'))
+    return hasattr(message.media, 'video')
+
+# Check file size BEFORE download to avoid timeout on huge files
+MAX_VIDEO_SIZE_MB = 50
+
+def video_rejection(message):
+    # Why a video is never downloaded (too big, or too long for the size cap), or None.
+    # Such posts only get their poster, in whichever stage sees them first.
+    if not is_video_message(message) or not hasattr(message.media, 'document'):
+        return None
+    file_size_bytes = message.media.document.size or 0
+    if file_size_bytes > MAX_VIDEO_SIZE_MB * 1024 * 1024:
+        return f"Size {file_size_bytes / (1024*1024):.2f} MB > {MAX_VIDEO_SIZE_MB} MB limit"
+    duration = video_transcode.info_from_document(message.media.document).get('duration')
+    if not video_transcode.can_fit(duration):
+        return f"{duration:.0f}s can't fit under the size cap"
+    return None
+
+async def download_media(client, message, msg_id, poster_only=False, item_id=None):
+    # Cache-aware entry point: media already processed for another item
+    # (e.g. a forward of the same Telegram file) is reused without download or ffmpeg.
+    # poster_only stops videos after the thumbnail; the full pass runs later.
+    # item_id is the owning feed item when it differs from msg_id (album members).
     if not message.media:
-        return None, None, None
+        return None, None, None, None
     
+    key = media_key(message)
+    if MEDIA_INDEX is None:
+        return await process_media(client, message, msg_id, poster_only)
+    if key is None:
+        result = await process_media(client, message, msg_id, poster_only)
+    else:
+        lock = MEDIA_KEY_LOCKS.setdefault(key, asyncio.Lock())
+        async with lock:
+            result = MEDIA_INDEX.lookup(key, MEDIA_DIR)
+            if result:
+                print(f"♻️ Media cache hit for {msg_id} ({key})")
+                METRICS.add('media_cache_hits')
+            else:
+                METRICS.add('media_cache_misses')
+                result = await process_media(client, message, file_stem_for_key(key), poster_only)
+                # Only complete results are cached; degraded ones (e.g. poster only) retry next time.
+                # The poster of a rejected video is all it will ever get.
+                if result[0] and (not poster_only or video_rejection(message)):
+                    MEDIA_INDEX.record(key, *result)
+    
+    # Keep the manifest current as files are written or reused (drives the LRU quota)
+    MEDIA_INDEX.track_files(MEDIA_DIR, [result[0], result[2]] + variant_urls(result[3]), item_id or msg_id, time.time())
+    return tuple(result)
+
+async def process_media(client, message, msg_id, poster_only=False):
+    # msg_id is the base name used for the output files
     # Identify media type
-    is_video = False
-    if hasattr(message.media, 'document'):
-        mime = message.media.document.mime_type
-        if mime and mime.startswith('video/'):
-            is_video = True
-    elif hasattr(message.media, 'video'):
-        is_video = True
+    is_video = is_video_message(message)
         
     temp_path = os.path.join(MEDIA_DIR, f"temp_{msg_id}")
     final_poster_path = os.path.join(MEDIA_DIR, f"{msg_id}_poster.jpg")
@@ -128,40 +313,37 @@ async def download_media(client, message, msg_id):
     media_url = None
     poster_url = None
     media_type = 'image'
+    # Responsive variants of the image the item shows (the photo, or the video's poster)
+    variants = None
+    poster_stem = os.path.join(MEDIA_DIR, f"{msg_id}_poster") if is_video else None
 
-    # Check file size BEFORE download to avoid timeout on huge files
-    MAX_VIDEO_SIZE_MB = 50
-    file_size_bytes = 0
-    if hasattr(message.media, 'document'):
-        file_size_bytes = message.media.document.size
-    elif hasattr(message.media, 'photo'):
-        # Photos are usually small, but good to check
-        pass
-        
-    if is_video and file_size_bytes > MAX_VIDEO_SIZE_MB * 1024 * 1024:
-        print(f"⚠️ Skipping video {msg_id}: Size {file_size_bytes / (1024*1024):.2f} MB > {MAX_VIDEO_SIZE_MB} MB limit.")
-        # We will still try to get the thumbnail below
-        is_video = False
+    # Videos that can't fit under the cap at any usable bitrate (duration from Telegram's attributes)
+    # or are too big to download only get the thumbnail below
+    rejection = video_rejection(message) if is_video else None
+    if rejection:
+        print(f"⚠️ Skipping video {msg_id}: {rejection}.")
+    doc_info = video_transcode.info_from_document(message.media.document) if is_video and hasattr(message.media, 'document') else {}
     
     try:
         # 1. ALWAYS download/ensure a thumbnail (poster)
         if not os.path.exists(final_poster_path):
-            thumb_path = await client.download_media(message, file=temp_path, thumb=-1)
+            with METRICS.phase('media.thumbnail'):
+                thumb_path = await client.download_media(message, file=temp_path, thumb=-1)
             if thumb_path and os.path.exists(thumb_path):
+                METRICS.add('bytes_downloaded', os.path.getsize(thumb_path))
                 try:
-                    with Image.open(thumb_path) as img:
-                        if img.mode in ("RGBA", "P", "CMYK"):
-                            img = img.convert("RGB")
-                        max_size = 1200
-                        if img.width > max_size or img.height > max_size:
-                            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                        img.save(final_poster_path, "JPEG", quality=80, optimize=True)
+                    variants = await compress_image(thumb_path, final_poster_path, poster_stem)
                     poster_url = f"/media/{msg_id}_poster.jpg"
                 finally:
                     if os.path.exists(thumb_path):
                         os.remove(thumb_path)
         else:
             poster_url = f"/media/{msg_id}_poster.jpg"
+            variants = await existing_image_variants(final_poster_path, poster_stem)
+
+        if rejection or (poster_only and is_video):
+            # Show the poster until the deferred video pass replaces it (for good if the video was rejected)
+            return poster_url, 'image' if poster_url else None, poster_url, variants
 
         # 1.5 FFmpeg Thumbnail Fallback (If Telegram didn't have one)
         if not os.path.exists(final_poster_path) and is_video:
@@ -172,57 +354,37 @@ async def download_media(client, message, msg_id):
         # 2. Download and COMPRESS video
         if is_video:
             if not os.path.exists(final_video_path):
-                raw_video_path = f"{temp_path}_raw.mp4"
-                v_path = await client.download_media(message, file=raw_video_path)
+                raw_video_path = os.path.join(work_dir_for(MEDIA_DIR), f"{msg_id}_raw.mp4")
+                v_path = await download_video_file(client, message, raw_video_path)
                 if v_path and os.path.exists(v_path):
                     try:
                         file_size_mb = os.path.getsize(v_path) / (1024 * 1024)
                         print(f"Processing video {msg_id} (Size: {file_size_mb:.2f} MB)...")
                         
-                        # --- ADAPTIVE COMPRESSION LOGIC ---
-                        if file_size_mb < 15:
-                            # GREEN ZONE: Light/Standard Compression
-                            # Keep 480p, decent text/visuals
-                            preset = 'faster'
-                            crf = '28'
-                            scale = "scale='min(480,iw)':-2"
-                            fps = '24'
-                            audio_br = '64k'
-                            print("  🟢 Green Zone: Standard compression")
-                        elif file_size_mb < 50:
-                            # YELLOW ZONE: Strong Compression
-                            # Drop to 360p, lower quality
-                            preset = 'veryfast'
-                            crf = '34'
-                            scale = "scale='min(360,iw)':-2"
-                            fps = '20'
-                            audio_br = '48k'
-                            print("  🟡 Yellow Zone: Strong compression")
-                        else:
-                            # RED ZONE: Nuclear Compression
-                            # Huge file! Aggressive shrinking needed.
-                            preset = 'ultrafast'
-                            crf = '40' # Very low quality
-                            scale = "scale='min(360,iw)':-2"
-                            fps = '15' # Choppy but small
-                            audio_br = '32k'
-                            print("  🔴 Red Zone: Nuclear compression")
-
-                        cmd = [
-                            'ffmpeg', '-y', '-i', v_path,
-                            '-vcodec', 'libx264', '-crf', crf, '-preset', preset,
-                            '-r', fps, 
-                            '-acodec', 'aac', '-ac', '1', '-b:a', audio_br, '-movflags', 'faststart',
-                            '-vf', scale,
-                            final_video_path
-                        ]
-                        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                        # --- TRANSCODE PLANNER ---
+                        # ffprobe first, then remux, encode at a bitrate that fits, or give up before encoding
+                        info = dict(doc_info)
+                        try:
+                            with METRICS.phase('media.ffprobe'):
+                                info.update(await video_transcode.probe_video(v_path))
+                        except Exception as pe:
+                            print(f"  ffprobe failed for {msg_id}: {pe}")
+                        plan = video_transcode.plan_transcode(info, os.path.getsize(v_path))
+                        print(f"  🎬 {plan['action']}: {plan['reason']}")
+                        if plan['action'] == 'skip':
+                            raise ValueError("video can't fit under the size cap")
+
+                        # Encoded under a temporary name: a killed run never leaves a truncated mp4
+                        # that the next run would take for a finished one
+                        with atomic_path(final_video_path, keep_extension=True) as tmp_video_path:
+                            cmd = video_transcode.build_ffmpeg_cmd(v_path, tmp_video_path, plan)
+                            await run_ffmpeg(cmd)
 
-                        # Final Safety Check: If still > 22MB, delete it to prevent build failure
-                        if os.path.exists(final_video_path) and os.path.getsize(final_video_path) > 22 * 1024 * 1024:
-                            print(f"Warning: Video {msg_id} too large ({os.path.getsize(final_video_path)} bytes) after compression, deleting.")
-                            os.remove(final_video_path)
-                            return None, None, None
+                            # Final Safety Check: If still > 22MB, delete it to prevent build failure
+                            if os.path.exists(tmp_video_path) and os.path.getsize(tmp_video_path) > video_transcode.MAX_OUTPUT_BYTES:
+                                print(f"Warning: Video {msg_id} too large ({os.path.getsize(tmp_video_path)} bytes) after compression, deleting.")
+                                os.remove(tmp_video_path)
+                                return None, None, None, None
                         
                         if os.path.exists(final_video_path):
                             media_url = f"/media/{msg_id}.mp4"
@@ -245,32 +407,31 @@ async def download_media(client, message, msg_id):
             if not os.path.exists(final_poster_path) and os.path.exists(final_video_path):
                 try:
                     print(f"  generating fallback poster for {msg_id}...")
-                    cmd_thumb = [
-                        'ffmpeg', '-y', '-i', final_video_path,
-                        '-ss', '00:00:01.000', '-vframes', '1',
-                        final_poster_path
-                    ]
-                    # If video is < 1s, try 0s
-                    subprocess.run(cmd_thumb, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                    with atomic_path(final_poster_path, keep_extension=True) as tmp_poster_path:
+                        cmd_thumb = [
+                            'ffmpeg', '-y', '-i', final_video_path,
+                            '-ss', '00:00:01.000', '-vframes', '1',
+                            tmp_poster_path
+                        ]
+                        # If video is < 1s, try 0s
+                        await run_ffmpeg(cmd_thumb)
                     if os.path.exists(final_poster_path):
                         poster_url = f"/media/{msg_id}_poster.jpg"
+                        variants = await existing_image_variants(final_poster_path, poster_stem)
                 except Exception as e:
                     print(f"  Failed to generate fallback poster: {e}")
 
         else:
             # It's a photo (as before)
             final_photo_path = os.path.join(MEDIA_DIR, f"{msg_id}.jpg")
+            photo_stem = os.path.join(MEDIA_DIR, msg_id)
             if not os.path.exists(final_photo_path):
-                p_path = await client.download_media(message, file=temp_path)
+                with METRICS.phase('media.download'):
+                    p_path = await client.download_media(message, file=temp_path)
                 if p_path and os.path.exists(p_path):
+                    METRICS.add('bytes_downloaded', os.path.getsize(p_path))
                     try:
-                        with Image.open(p_path) as img:
-                            if img.mode in ("RGBA", "P", "CMYK"):
-                                img = img.convert("RGB")
-                            max_size = 1200
-                            if img.width > max_size or img.height > max_size:
-                                img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                            img.save(final_photo_path, "JPEG", quality=80, optimize=True)
+                        variants = await compress_image(p_path, final_photo_path, photo_stem)
                         media_url = f"/media/{msg_id}.jpg"
                         media_type = 'image'
                     finally:
@@ -279,292 +440,998 @@ async def download_media(client, message, msg_id):
             else:
                 media_url = f"/media/{msg_id}.jpg"
                 media_type = 'image'
+                variants = await existing_image_variants(final_photo_path, photo_stem)
                 
+    except (DownloadInterrupted, FloodWaitError, ConnectionError) as e:
+        # Keep the poster we already have; the media is retried on the next run
+        e.poster_url = poster_url
+        e.poster_variants = variants
+        raise
     except Exception as e:
         print(f"Error processing media for {msg_id}: {e}")
             
-    return media_url, media_type, poster_url
+    return media_url, media_type, poster_url, variants
+
+def hold_media(error):
+    # True if a media job that failed with error should be retried next run rather than
+    # left empty: the download was cut off, Telegram asked for a FloodWait or the
+    # connection dropped. A FloodWait also closes the shared gate for every worker.
+    global FLOOD_WAIT_UNTIL
+    cause = error.__cause__ if isinstance(error, DownloadInterrupted) and error.__cause__ else error
+    if isinstance(cause, FloodWaitError):
+        METRICS.add('flood_waits')
+        FLOOD_WAIT_UNTIL = max(FLOOD_WAIT_UNTIL, time.time() + cause.seconds)
+    return isinstance(error, (DownloadInterrupted, FloodWaitError, ConnectionError))
+
+def apply_media(item, media_result):
+    media_path, media_type, poster_path, variants = media_result
+    item['media'] = media_path
+    item['mediaType'] = media_type
+    item['poster'] = poster_path
+    item['imageVariants'] = variants
+
+def apply_album(item, messages, results):
+    # One album entry per member, in message order; the item's own media fields mirror
+    # the first member that has something to show. Returns True if a member was interrupted.
+    album = []
+    interrupted = False
+    for message, result in zip(messages, results):
+        if isinstance(result, Exception) and hold_media(result):
+            print(f"⏸️ Media for {item['id']} ({message.id}) interrupted ({result}), will resume next run")
+            METRICS.add('media_interrupted')
+            interrupted = True
+            result = (None, None, getattr(result, 'poster_url', None), getattr(result, 'poster_variants', None))
+        elif isinstance(result, BaseException):
+            print(f"Media worker error for {item['id']} ({message.id}): {result}")
+            result = (None, None, None, None)
+        entry = {'msgId': message.id}
+        apply_media(entry, result)
+        album.append(entry)
+    item['album'] = album
+    first = next((entry for entry in album if entry['media'] or entry['poster']), album[0])
+    apply_media(item, (first['media'], first['mediaType'], first['poster'], first['imageVariants']))
+    return interrupted
+
+def media_kind(message):
+    # Planner cost key of a media job; an album costs like a video if any member is one
+    messages = message if isinstance(message, list) else [message]
+    return 'media:video' if any(is_video_message(m) for m in messages) else 'media:photo'
+
+async def run_media_job(client, item, message, msg_id, stage):
+    # message is a Message, or the member list of an album (all fetched concurrently).
+    # In the 'fast' stage videos only get their poster and are deferred to the 'full' stage.
+    kind = media_kind(message)
+    poster_only = stage == 'fast' and kind == 'media:video'
+    if not poster_only:
+        MEDIA_ATTEMPTED.add(item['id'])
+    if isinstance(message, list):
+        downloads = asyncio.gather(*[
+            download_media(client, m, f"{msg_id}_{m.id}", poster_only, item_id=item['id']) for m in message
+        ], return_exceptions=True)
+        if poster_only:
+            results = await downloads
+        else:
+            # Timed as one job, so the planner learns what a whole album costs
+            with METRICS.phase(f'job.{kind}'):
+                results = await downloads
+        if apply_album(item, message, results):
+            INTERRUPTED_MEDIA[item['id']] = item
+        elif poster_only and any(is_video_message(m) and entry['mediaType'] != 'video' and not video_rejection(m)
+                                 for m, entry in zip(message, item['album'])):
+            DEFERRED_MEDIA.append((item, message, msg_id))
+        return
+    if poster_only:
+        result = await download_media(client, message, msg_id, poster_only=True)
+        apply_media(item, result)
+        if result[1] != 'video' and not video_rejection(message):
+            DEFERRED_MEDIA.append((item, message, msg_id))
+        return
+    with METRICS.phase(f'job.{kind}'):
+        apply_media(item, await download_media(client, message, msg_id))
+
+async def media_worker(client, media_queue):
+    # Download stage of the media pipeline. Jobs are (item, message, msg_id, stage);
+    # results are written straight into the item dict, which is already part of the channel results.
+    while True:
+        item, message, msg_id, stage = await media_queue.get()
+        try:
+            # Respect a FloodWait raised by any other download (or channel fetch) first
+            wait = FLOOD_WAIT_UNTIL - time.time()
+            while wait > 0 and not run_should_stop() and (PLANNER is None or PLANNER.remaining() > wait):
+                METRICS.add('flood_wait_seconds', wait)
+                await asyncio.sleep(wait)
+                wait = FLOOD_WAIT_UNTIL - time.time()
+            # Fast-stage jobs only fetch video posters, so they cost like photos
+            cost_key = 'media:photo' if stage == 'fast' else media_kind(message)
+            if run_should_stop() or wait > 0 or (PLANNER is not None and not PLANNER.can_start(cost_key)):
+                # Not started before the deadline (or a FloodWait that outlasts it): retried next run
+                INTERRUPTED_MEDIA[item['id']] = item
+                continue
+            await run_media_job(client, item, message, msg_id, stage)
+        except asyncio.CancelledError:
+            # Cut off at the deadline: retried next run
+            INTERRUPTED_MEDIA[item['id']] = item
+            raise
+        except Exception as e:
+            if not hold_media(e):
+                print(f"Media worker error for {msg_id}: {e}")
+                continue
+            print(f"⏸️ Media for {msg_id} interrupted ({e}), will resume next run")
+            METRICS.add('media_interrupted')
+            apply_media(item, (None, None, getattr(e, 'poster_url', None), getattr(e, 'poster_variants', None)))
+            INTERRUPTED_MEDIA[item['id']] = item
+        finally:
+            media_queue.task_done()
+
+async def resume_pending_media(client, store, channels):
+    # Re-fetches the messages of items whose media was interrupted in earlier runs
+    # (every member of an album). Returns their (item, message, item_id) jobs for the deferred media stage.
+    pending = store.pending_media()
+    if not pending:
+        return []
+    targets = {ch['name']: ch for ch in channels}
+    items = store.get_items([row[0] for row in pending])
+    
+    dropped = []
+    by_source = {}
+    for item_id, source, msg_id, attempts in pending:
+        if item_id not in items or source not in targets or attempts >= MAX_MEDIA_ATTEMPTS:
+            dropped.append(item_id)
+        else:
+            by_source.setdefault(source, []).append((item_id, msg_id))
+    
+    resumed = []
+    for source, rows in by_source.items():
+        ids = [album_ids(items[item_id], msg_id) for item_id, msg_id in rows]
+        try:
+            entity = await client.get_input_entity(build_channel_target(targets[source]))
+            fetched = await client.get_messages(entity, ids=[i for member_ids in ids for i in member_ids])
+        except FloodWaitError:
+            break
+        except Exception as e:
+            print(f"Error resuming media for {source}: {e}")
+            continue
+        messages = dict(zip([i for member_ids in ids for i in member_ids], fetched))
+        for (item_id, _), member_ids in zip(rows, ids):
+            members = [messages[i] for i in member_ids if messages.get(i) is not None and messages[i].media]
+            if not members:
+                dropped.append(item_id)
+                continue
+            resumed.append((items[item_id], members if items[item_id].get('album') else members[0], item_id))
+    
+    store.clear_pending(dropped)
+    if resumed:
+        print(f"⏯️ Resuming media for {len(resumed)} items from earlier runs")
+    return resumed
+
+async def wait_for_media(media_queue):
+    # Joins the media queue, but never past the planner's work deadline
+    try:
+        await asyncio.wait_for(media_queue.join(), timeout=max(0, PLANNER.remaining()))
+        return True
+    except asyncio.TimeoutError:
+        print("⏳ Work deadline reached, cutting off in-flight media")
+        return False
+
+def message_hash(message):
+    # Everything of a message that ends up in its item; an edit changes it
+    links = [ent.url for ent in message.entities or [] if isinstance(ent, MessageEntityTextUrl)]
+    payload = json.dumps([message.text or '', links, media_key(message), bool(getattr(message.media, 'spoiler', False))])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def group_hash(messages):
+    if len(messages) == 1:
+        return message_hash(messages[0])
+    return hashlib.sha1('|'.join(message_hash(m) for m in messages).encode('utf-8')).hexdigest()
+
+def group_media_key(messages):
+    if len(messages) == 1:
+        return media_key(messages[0])
+    return ','.join(str(media_key(m)) for m in messages)
+
+def album_ids(item, msg_id):
+    # Telegram message ids behind a stored item
+    if item.get('album'):
+        return [entry['msgId'] for entry in item['album']]
+    return [msg_id]
+
+def build_item(message, channel_name, album=None, item_id=None):
+    # Feed item for a message, with media left empty (filled in by download_media).
+    # For an album (members in id order) message is the member carrying the caption, which
+    # is cleaned once for the whole group; the item takes the newest member's id so the
+    # high-water mark moves past the album. item_id keeps the id of an existing item.
+    group = album or [message]
+    msg_id = item_id or f"{channel_name}_{group[-1].id}"
+    CONTENT_HASHES[msg_id] = (group_hash(group), group_media_key(group))
+    
+    # Extract link
+    link = None
+    if message.entities:
+        for ent in message.entities:
+            if isinstance(ent, MessageEntityTextUrl):
+                link = ent.url
+                break
+    
+    final_text = clean_text(message.text, channel_name) if message.text else ""
+
+    item = {
+        "id": msg_id,
+        "source": channel_name,
+        "text": final_text,
+        "date": message.date.isoformat(),
+        "link": link if link else f"https://t.me/{channel_name}/{message.id}",
+        "media": None,
+        "mediaType": None,
+        "poster": None,
+        "imageVariants": None,
+        "sensitive": any(getattr(m.media, 'spoiler', False) for m in group)
+    }
+    if album:
+        item["album"] = [
+            {"msgId": m.id, "media": None, "mediaType": None, "poster": None, "imageVariants": None}
+            for m in album
+        ]
+    return item
 
-async def fetch_channel_news(client, target, channel_name, limit, min_id=0):
+async def fetch_channel_news(client, target, channel_name, limit, min_id=0, deadline=None, media_queue=None, gap=None):
+    # Returns (items, finished). finished is False when the run was stopped mid-channel.
+    # With a media_queue, media jobs are enqueued and filled in later by media_worker.
+    # Messages sharing a grouped_id (an album) arrive next to each other and become one item.
+    # Messages are read newest first and the items move the channel's high-water mark, so a
+    # run stopped mid-channel leaves a gap below what it read: (min_id, max_id, messages left),
+    # kept in FETCH_GAPS and read before anything newer on the next run.
     news_items = []
+    finished = False
+    floor = None        # lowest message id taken into an item, and how many messages were read down to it
+    floor_count = 0
+    current = None      # the range being read
+    
+    def leave_gap():
+        range_min, range_max, range_limit = current
+        if floor is not None:
+            FETCH_GAPS[channel_name] = (range_min, floor, range_limit - floor_count)
+        elif range_max:
+            FETCH_GAPS[channel_name] = current
+    
+    async def add_item(item, media):
+        if media:
+            if media_queue is not None:
+                # Bounded queue: blocks iteration when downloads fall behind
+                await media_queue.put((item, media, item['id'], 'fast'))
+            else:
+                await run_media_job(client, item, media, item['id'], 'full')
+        news_items.append(item)
+    
+    async def add_album(members, read):
+        nonlocal floor, floor_count
+        members.sort(key=lambda m: m.id)
+        floor, floor_count = members[0].id, read
+        if len(members) == 1:
+            # Same rule as ungrouped messages
+            if members[0].text or members[0].media:
+                await add_item(build_item(members[0], channel_name), members[0] if members[0].media else None)
+            return
+        caption = next((m for m in members if m.text), members[0])
+        await add_item(build_item(caption, channel_name, album=members), [m for m in members if m.media] or None)
+    
     try:
         print(f"Fetching news from {channel_name} (Target: {target}, Limit: {limit}, Min ID: {min_id})...")
         entity = await client.get_input_entity(target)
         
-        count = 0
-        async for message in client.iter_messages(entity, limit=limit, min_id=min_id):
-            count += 1
-            if not message.text and not message.media:
-                continue
-            
-            print(f"  [{channel_name}] Processing message {count}...")
+        # The gap a cut run left, then everything newer than the high-water mark
+        ranges = ([gap] if gap else []) + [(min_id, 0, limit)]
+        for current in ranges:
+            range_min, range_max, range_limit = current
+            floor, floor_count = None, 0
+            count = 0
+            album = []
+            async for message in client.iter_messages(entity, limit=range_limit, min_id=range_min, max_id=range_max):
+                if STOP_REQUESTED or (deadline and time.time() > deadline):
+                    # A partly read album is dropped; it lies below the floor, so the gap covers it
+                    print(f"⏳ [{channel_name}] Deadline reached after {count} messages.")
+                    leave_gap()
+                    return news_items, False
+                count += 1
+                if album and message.grouped_id != album[0].grouped_id:
+                    await add_album(album, count - 1)
+                    album = []
+                if message.grouped_id:
+                    album.append(message)
+                    continue
+                floor, floor_count = message.id, count
+                if not message.text and not message.media:
+                    continue
                 
-            msg_id = f"{channel_name}_{message.id}"
+                print(f"  [{channel_name}] Processing message {count}...")
+                
+                await add_item(build_item(message, channel_name), message if message.media else None)
+            if album:
+                await add_album(album, count)
+            if range_max:
+                # The gap is closed
+                FETCH_GAPS[channel_name] = None
+        finished = True
             
-            # Extract link
-            link = None
-            if message.entities:
-                for ent in message.entities:
-                    if isinstance(ent, MessageEntityTextUrl):
-                        link = ent.url
-                        break
+    except FloodWaitError:
+        # Handled by the scheduler (shared backoff + retry)
+        raise
+    except Exception as e:
+        error_msg = f"Error fetching from {channel_name}: {e}"
+        print(error_msg)
+        DEBUG_ERRORS.append(error_msg)
+        if isinstance(e, ChannelInvalidError):
+            STALE_PEERS.add(channel_name)
+        FAILED_CHANNELS.add(channel_name)
+        if current is not None:
+            # Items read before the error still move the mark
+            leave_gap()
+        finished = True
+        
+    return news_items, finished
+
+def build_channel_target(ch_info):
+    channel_id = ch_info['id']
+    channel_hash = ch_info['hash']
+    
+    target = ch_info['name'] # Default
+    if channel_id and channel_hash:
+        target = InputPeerChannel(channel_id=channel_id, access_hash=channel_hash)
+    elif channel_id:
+        target = channel_id # Might fail without hash in fresh session but try anyway
+    return target
+
+async def reconcile_channel(client, store, ch_info, window, media_queue):
+    # Re-fetches the channel's newest stored posts in batches and compares content hashes.
+    # Returns (changed_items, deleted_ids, adopted_items). Changed items keep their media unless
+    # it changed; adopted items were stored before hashing and only get their text refreshed.
+    channel_name = ch_info['name']
+    rows = store.recheck_window(channel_name, window)
+    if not rows:
+        return [], [], []
+    entity = await client.get_input_entity(build_channel_target(ch_info))
+    changed = []
+    deleted = []
+    adopted = []
+    for start in range(0, len(rows), RECHECK_BATCH):
+        batch = rows[start:start + RECHECK_BATCH]
+        old_items = store.get_items([row[0] for row in batch])
+        # Albums are re-checked member by member, all in the same request
+        ids = [album_ids(old_items.get(row[0], {}), row[1]) for row in batch]
+        flat_ids = [i for member_ids in ids for i in member_ids]
+        messages = dict(zip(flat_ids, await client.get_messages(entity, ids=flat_ids)))
+        for (item_id, _, old_hash, old_media_key), member_ids in zip(batch, ids):
+            group = [messages[i] for i in member_ids if messages.get(i) is not None]
+            group = [m for m in group if m.text or m.media]
+            if not group:
+                deleted.append(item_id)
+                continue
+            if group_hash(group) == old_hash:
+                continue
+            old = old_items.get(item_id, {})
+            caption = next((m for m in group if m.text), group[0])
+            item = build_item(caption, channel_name, album=group if old.get('album') else None, item_id=item_id)
+            fields = ('media', 'mediaType', 'poster', 'imageVariants', 'album')
+            if old_hash is None:
+                for field in fields:
+                    if field in old or field in item:
+                        item[field] = old.get(field)
+                adopted.append(item)
+                continue
+            media = [m for m in group if m.media]
+            if media and old_media_key == group_media_key(group) and (old.get('media') or old.get('poster')):
+                for field in fields:
+                    if field in old or field in item:
+                        item[field] = old.get(field)
+            elif media:
+                await media_queue.put((item, media if old.get('album') else media[0], item_id, 'fast'))
+            changed.append(item)
+    return changed, deleted, adopted
+
+async def reconcile_channels(client, store, channels, media_queue):
+    # Sliding-window edit/deletion check over every channel, after the new posts are in.
+    # Returns (items_to_save, deleted_ids); channels left when a FloodWait hits are skipped.
+    if args.recheck_window <= 0 or not PLANNER.can_start('reconcile'):
+        return [], []
+    semaphore = asyncio.Semaphore(max(1, args.channel_concurrency))
+    flooded = False
+    
+    async def recheck(ch_info):
+        global FLOOD_WAIT_UNTIL
+        nonlocal flooded
+        async with semaphore:
+            if flooded or run_should_stop() or FLOOD_WAIT_UNTIL > time.time():
+                return [], [], []
+            try:
+                result = await reconcile_channel(client, store, ch_info, args.recheck_window, media_queue)
+                RECHECKED_CHANNELS.add(ch_info['name'])
+                return result
+            except FloodWaitError as e:
+                flooded = True
+                FLOOD_WAIT_UNTIL = max(FLOOD_WAIT_UNTIL, time.time() + e.seconds)
+                print(f"🐢 FloodWait ({e.seconds}s) while re-checking {ch_info['name']}, skipping the rest")
+            except Exception as e:
+                print(f"Error re-checking {ch_info['name']}: {e}")
+            return [], [], []
+    
+    with METRICS.phase('reconcile'):
+        results = await asyncio.gather(*[recheck(ch_info) for ch_info in channels])
+    changed = [item for items, _, _ in results for item in items]
+    deleted = [item_id for _, ids, _ in results for item_id in ids]
+    adopted = [item for _, _, items in results for item in items]
+    if changed or deleted or adopted:
+        print(f"✏️ Re-check: {len(changed)} edited, {len(deleted)} deleted, {len(adopted)} hashed for the first time")
+    METRICS.add('items_edited', len(changed))
+    METRICS.add('items_deleted', len(deleted))
+    return changed + adopted, deleted
+
+async def fetch_channel_bounded(client, semaphore, ch_info, limit, min_id, deadline, media_queue=None, max_flood_retries=3, gap=None):
+    # Runs one channel under the concurrency cap.
+    # Returns (items, status) where status is 'done', 'partial' or 'skipped'.
+    global FLOOD_WAIT_UNTIL
+    channel_name = ch_info['name']
+    target = build_channel_target(ch_info)
+    
+    async with semaphore:
+        for attempt in range(max_flood_retries + 1):
+            # Respect a FloodWait raised by any other channel before sending anything
+            wait = FLOOD_WAIT_UNTIL - time.time()
+            if wait > 0:
+                if time.time() + wait > deadline:
+                    METRICS.channel(channel_name, status='skipped')
+                    return [], 'skipped'
+                METRICS.add('flood_wait_seconds', wait)
+                await asyncio.sleep(wait)
             
-            media_path, media_type, poster_path = await download_media(client, message, msg_id)
+            if STOP_REQUESTED or time.time() > deadline:
+                METRICS.channel(channel_name, status='skipped')
+                return [], 'skipped'
             
+            if min_id > 0:
+                print(f"🔄 Smart Sync for {channel_name}: Fetching only messages > {min_id}")
+            if gap:
+                print(f"🔄 {channel_name}: resuming {gap[0]} < id < {gap[1]} left by a stopped run")
             
-            final_text = clean_text(message.text) if message.text else ""
+            try:
+                started = time.perf_counter()
+                items, finished = await fetch_channel_news(client, target, channel_name, limit, min_id=min_id, deadline=deadline, media_queue=media_queue, gap=gap)
+                status = 'done' if finished else 'partial'
+                METRICS.record('fetch_channel_news', time.perf_counter() - started)
+                METRICS.channel(channel_name, status=status, items=len(items), seconds=round(time.perf_counter() - started, 3))
+                return items, status
+            except FloodWaitError as e:
+                METRICS.add('flood_waits')
+                # Exponential backoff on top of what Telegram asked for
+                backoff = e.seconds + 2 ** attempt
+                print(f"🐢 FloodWait on {channel_name}: sleeping {backoff}s (attempt {attempt + 1}/{max_flood_retries + 1})")
+                FLOOD_WAIT_UNTIL = max(FLOOD_WAIT_UNTIL, time.time() + backoff)
+                
+    DEBUG_ERRORS.append(f"Giving up on {channel_name} after {max_flood_retries + 1} FloodWaits")
+    METRICS.channel(channel_name, status='skipped')
+    return [], 'skipped'
 
+def clear_deleted_media(entry, names):
+    # Drops references to deleted files from an item (or album entry); True if any were dropped
+    modified = False
+    if entry.get('media') and os.path.basename(entry['media']) in names:
+        entry['media'] = None
+        entry['mediaType'] = None
+        modified = True
+    if entry.get('poster') and os.path.basename(entry['poster']) in names:
+        entry['poster'] = None
+        modified = True
+    if any(os.path.basename(url) in names for url in variant_urls(entry.get('imageVariants'))):
+        # The JPEG fallback (if still there) keeps working without variants
+        entry['imageVariants'] = None
+        modified = True
+    return modified
+
+def export_feed(store, new_news):
+    # Merges new_news into the store, applies the JSON and media quotas and writes
+    # the feed, the error log and the run report
+    # Dedup happens on the item id primary key; the feed is then exported newest first.
+    # Items from channels no longer in the config are kept, like before.
+    METRICS.lap('merge')
+    METRICS.add('items_fetched', len(new_news))
+    # Commit journal: exports that never finished left the store ahead of the files on disk.
+    # Their journaled media deletions are rolled forward below and the outputs rewritten,
+    # instead of starting over.
+    unfinished = store.unfinished_exports()
+    if unfinished:
+        print(f"↩️ Recovering {len(unfinished)} interrupted export(s)")
+    generation = store.begin_export(time.time())
+    # Edited texts are fingerprinted again, so an edit can move an item into or out of a cluster
+    stored = store.get_items([item['id'] for item in new_news])
+    edited = [item['id'] for item in new_news if item['id'] in stored and stored[item['id']]['text'] != item['text']]
+    store.upsert_items(new_news)
+    store.forget_fingerprints(edited)
+    store.set_content_hashes({item['id']: CONTENT_HASHES[item['id']] for item in new_news if item['id'] in CONTENT_HASHES})
+    CONTENT_HASHES.clear()
+    # Reposts of a story already in the feed join its cluster instead of becoming items of their own
+    clustered = cluster_items(store, store.unclustered_items())
+    if clustered:
+        print(f"🔗 Folded {clustered} near-duplicate items into earlier stories")
+    METRICS.add('items_clustered', clustered)
+    
+    # --- Volumetric Quota System ---
+    MAX_JSON_SIZE_MB = 10
+    MAX_REPO_MEDIA_SIZE_MB = 400
+    MAX_MEDIA_DIR_SIZE_BYTES = MAX_REPO_MEDIA_SIZE_MB * 1024 * 1024
+    
+    # 1. Volumetric JSON Limit
+    # Each item is encoded once in the exact on-disk format (indent=2) and the
+    # cutoff is chosen in one pass over the store, newest first.
+    METRICS.lap('json_budget')
+    merged_news, feed_chunks, truncated = take_within_budget(store.iter_latest(), MAX_JSON_SIZE_MB * 1024 * 1024)
+    
+    # Cleanup orphaned media files
+    # NOTE: With split files, multiple JSONs reference the same MEDIA_DIR.
+    # Removing orphans based on ONE json file is DANGEROUS because another JSON might need them.
+    # Orphans are collected by the separate `gc` command, which reads every feed (see media_gc.py).
+    
+    # 2. GLOBAL SIZE SAFETY SWEEP (Fix for Cloudflare 25MB limit)
+    # Works off the persisted media manifest; the directory is only scanned to seed an empty one.
+    METRICS.lap('media_sweep')
+    print("Running Global Size Safety Sweep...")
+    if not MEDIA_INDEX.has_files():
+        print(f"📦 Seeded media manifest with {MEDIA_INDEX.rebuild_files(MEDIA_DIR)} files")
+        
+    oversized = MEDIA_INDEX.oversized(22 * 1024 * 1024)
+    # Deletions of interrupted exports may have happened without their references being cleared
+    deleted_files = sorted({name for _, names in unfinished for name in names})
+    already_deleted = set(deleted_files)
+    for filename, file_size in oversized:
+        if filename not in already_deleted:
+            print(f"⚠️ Safety Sweep: Deleting oversized existing file {filename} ({file_size // (1024*1024)} MB)")
+            deleted_files.append(filename)
+            already_deleted.add(filename)
+
+    # 3. VOLUMETRIC MEDIA LIMIT (Global Folder Quota)
+    # Walk the manifest least-recently-used first until the folder fits
+    total_media_size = MEDIA_INDEX.total_size() - sum(size for _, size in oversized)
+    if total_media_size > MAX_MEDIA_DIR_SIZE_BYTES:
+        for filename, file_size in MEDIA_INDEX.iter_lru():
+            if total_media_size <= MAX_MEDIA_DIR_SIZE_BYTES:
+                break
+            if filename in already_deleted:
+                continue
+            deleted_files.append(filename)
+            total_media_size -= file_size
+            print(f"🧹 Volumetric limit reached: Deleted older file {filename}")
+    
+    # Journaled before anything is removed, so a kill in between can be rolled forward
+    if deleted_files:
+        store.journal_deletes(generation, deleted_files)
+    for filename in deleted_files:
+        try:
+            os.remove(os.path.join(MEDIA_DIR, filename))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error deleting media file {filename}: {e}")
             
-            item = {
-                "id": msg_id,
-                "source": channel_name,
-                "text": final_text,
-                "date": message.date.isoformat(),
-                "link": link if link else f"https://t.me/{channel_name}/{message.id}",
-                "media": media_path,
-                "mediaType": media_type,
-                "poster": poster_path,
-                "sensitive": getattr(message.media, 'spoiler', False)
-            }
-            news_items.append(item)
-            
-    except Exception as e:
-        error_msg = f"Error fetching from {channel_name}: {e}"
-        print(error_msg)
-        DEBUG_ERRORS.append(error_msg)
+    # Remove references to deleted media in the JSON via the manifest's reverse index
+    modified_items = {}
+    if deleted_files:
+        items_by_id = {item['id']: item for item in merged_news}
+        for item_id, names in MEDIA_INDEX.remove_files(deleted_files).items():
+            item = items_by_id.get(item_id)
+            if item is None:
+                # Belongs to another feed sharing MEDIA_DIR (or was evicted above)
+                continue
+            modified = False
+            for entry in [item] + (item.get('album') or []):
+                modified = clear_deleted_media(entry, names) or modified
+            if modified:
+                modified_items[item_id] = item
+
+    # Persist quota results: evicted items leave the store, cleared media references are saved
+    if truncated:
+        if merged_news:
+            evicted = store.delete_after(merged_news[-1]['date'], merged_news[-1]['id'])
+        else:
+            evicted = store.delete_all()
+        MEDIA_INDEX.drop_refs(evicted)
+        METRICS.add('items_evicted', len(evicted))
+        print(f"🧹 JSON size limit reached: Evicted {len(evicted)} older items")
+    METRICS.add('media_files_deleted', len(deleted_files))
+    store.upsert_items(modified_items.values())
+    
+    # Only items whose media references changed need re-encoding
+    if modified_items:
+        feed_chunks = [encode_feed_item(item) if item['id'] in modified_items else chunk
+                       for item, chunk in zip(merged_news, feed_chunks)]
+
+    # Write error log to a public file for debugging
+    METRICS.lap('write')
+    # Temporaries of killed runs
+    search_dir = search_dir_for(OUTPUT_FILE)
+    for out_dir in (os.path.dirname(OUTPUT_FILE), shard_dir_for(OUTPUT_FILE),
+                    os.path.join(search_dir, 'tokens'), os.path.join(search_dir, 'docs'), search_dir):
+        cleanup_temp_files(out_dir)
+    error_log_path = os.path.join(os.path.dirname(OUTPUT_FILE), 'debug_errors.txt')
+    with atomic_open(error_log_path, 'w', encoding='utf-8') as f:
+        source_counts = {}
+        for item in merged_news:
+            source_counts[item.get('source')] = source_counts.get(item.get('source'), 0) + 1
+        per_source = ''.join(f", {src}={count}" for src, count in sorted(source_counts.items(), key=lambda kv: str(kv[0])))
+        f.write(f"Stats: Total={len(merged_news)}{per_source}\n")
+        f.write("--- Errors ---\n")
+        # We need to make sure DEBUG_ERRORS exists or use a local list if we couldn't add the global one
+        if 'DEBUG_ERRORS' in globals():
+            for err in DEBUG_ERRORS:
+                f.write(f"{err}\n")
+        else:
+            f.write("DEBUG_ERRORS list not found (globals mismatch).\n")
+
+    if args.output_mode in ('single', 'both'):
+        write_feed(OUTPUT_FILE, feed_chunks)
+        METRICS.add('feed_bytes', os.path.getsize(OUTPUT_FILE))
+    if args.output_mode in ('sharded', 'both'):
+        # Same items as the single feed; unchanged shards are not rewritten
+        shard_files, shard_bytes = write_sharded(shard_dir_for(OUTPUT_FILE), merged_news)
+        METRICS.add('shard_files_written', shard_files)
+        METRICS.add('shard_bytes_written', shard_bytes)
+        print(f"🗂️ Sharded feed: wrote {shard_files} files ({shard_bytes / 1024:.1f} KB) to {shard_dir_for(OUTPUT_FILE)}")
+    # Search index over the exported items: only new, edited and removed items are re-tokenized
+    search_files, search_bytes = update_search_index(store, search_dir_for(OUTPUT_FILE), merged_news, {item['id'] for item in new_news},
+                                                     rebuild=bool(unfinished))
+    METRICS.add('search_files_written', search_files)
+    METRICS.add('search_bytes_written', search_bytes)
+    print(f"🔎 Search index: wrote {search_files} files ({search_bytes / 1024:.1f} KB) to {search_dir_for(OUTPUT_FILE)}")
+    # Every output is on disk: this generation (and any it recovered) is committed, and its
+    # new media is now referenced by the feed
+    store.commit_export(generation, time.time())
+    MEDIA_INDEX.commit_files({item['id'] for item in merged_news})
+    METRICS.add('items_exported', len(merged_news))
+    METRICS.lap()
+    post_fetch = sum(METRICS.phases[name]['seconds'] for name in ('merge', 'json_budget', 'media_sweep', 'write'))
+    store.update_costs({'post_fetch': post_fetch}, ewma)
+    METRICS.write(report_path_for(OUTPUT_FILE), status='ok', errors=DEBUG_ERRORS)
         
-    return news_items
+    print(f"Successfully saved {len(merged_news)} news items (merged) to {OUTPUT_FILE if args.output_mode != 'sharded' else shard_dir_for(OUTPUT_FILE)}")
 
-async def main():
-    print(f"Starting fetch with: Channels={args.channels}, Output={args.output}, Limit={args.limit}")
+async def run_daemon(client, store, channels):
+    # Keeps the connection of the normal run open and subscribes to new and edited posts
+    # of the configured channels. Items go through the same build_item/download_media path
+    # as a fetch, and the feed is re-exported once a burst of updates has settled.
+    global MEDIA_POOL, FFMPEG_SLOTS, RUN_DEADLINE, PLANNER
+    names_by_id = {ch['id']: ch['name'] for ch in channels if ch['id']}
+    unresolved = [ch['name'] for ch in channels if not ch['id']]
+    if unresolved:
+        print(f"Daemon: no live updates for unresolved channels: {', '.join(unresolved)}")
+    if not names_by_id:
+        print("Daemon: no resolved channels to listen to.")
+        return
+    
+    # No run deadline while live: every media job runs in full
+    RUN_DEADLINE = None
+    PLANNER = None
+    cpu_count = os.cpu_count() or 1
+    MEDIA_POOL = ProcessPoolExecutor(max_workers=cpu_count)
+    FFMPEG_SLOTS = asyncio.Semaphore(cpu_count)
+    media_queue = asyncio.Queue()
+    workers = [asyncio.create_task(media_worker(client, media_queue)) for _ in range(max(1, args.media_workers))]
+    
+    changed = {}
+    dirty = asyncio.Event()
     
+    def flush():
+        global METRICS
+        batch = list(changed.values())
+        changed.clear()
+        METRICS = RunMetrics()
+        METRICS.lap('live')
+        try:
+            store.add_pending(INTERRUPTED_MEDIA.values(), MEDIA_ATTEMPTED)
+            INTERRUPTED_MEDIA.clear()
+            MEDIA_ATTEMPTED.clear()
+            export_feed(store, batch)
+        except Exception as e:
+            print(f"Daemon flush failed: {e}")
+            METRICS.lap()
+            METRICS.write(report_path_for(OUTPUT_FILE), status='failed', errors=DEBUG_ERRORS + [str(e)])
+        DEBUG_ERRORS.clear()
+    
+    async def queue_item(item, media):
+        print(f"📨 Live update {item['id']}")
+        if media:
+            await media_queue.put((item, media, item['id'], 'full'))
+        # An edit replaces the item; its media comes from the cache unless the file changed
+        changed[item['id']] = item
+        dirty.set()
+    
+    async def on_message(event):
+        message = event.message
+        channel_name = names_by_id.get(getattr(message.peer_id, 'channel_id', None))
+        if channel_name is None or (not message.text and not message.media):
+            return
+        if message.grouped_id:
+            # New albums arrive through on_album; an edited member is picked up by the next run's re-check
+            return
+        await queue_item(build_item(message, channel_name), message if message.media else None)
+    
+    async def on_album(event):
+        members = sorted(event.messages, key=lambda m: m.id)
+        channel_name = names_by_id.get(getattr(members[0].peer_id, 'channel_id', None))
+        if channel_name is None:
+            return
+        caption = next((m for m in members if m.text), members[0])
+        item = build_item(caption, channel_name, album=members if len(members) > 1 else None)
+        media = [m for m in members if m.media]
+        await queue_item(item, (media if len(members) > 1 else media[0]) if media else None)
+    
+    targets = [build_channel_target(ch) for ch in channels if ch['id']]
+    client.add_event_handler(on_message, events.NewMessage(chats=targets))
+    client.add_event_handler(on_message, events.MessageEdited(chats=targets))
+    client.add_event_handler(on_album, events.Album(chats=targets))
+    print(f"📡 Daemon: listening to {len(targets)} channels, flushing at most every {args.flush_interval:g}s")
+    try:
+        while not STOP_REQUESTED:
+            try:
+                await asyncio.wait_for(dirty.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                continue
+            # Debounce: let the burst settle and its media finish, then export once
+            await asyncio.sleep(args.flush_interval)
+            await media_queue.join()
+            dirty.clear()
+            flush()
+        # Updates that arrived after the last flush (their media is retried next run)
+        if changed:
+            await media_queue.join()
+            flush()
+    finally:
+        client.remove_event_handler(on_message)
+        client.remove_event_handler(on_album)
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        MEDIA_POOL.shutdown()
+        MEDIA_POOL = None
+        print("📡 Daemon stopped.")
+
+def load_channels():
     if not os.path.exists(CHANNELS_FILE):
         print(f"Error: Channels file not found at {CHANNELS_FILE}")
         exit(1)
 
     with open(CHANNELS_FILE, 'r') as f:
         raw_channels = [line.strip() for line in f if line.strip()]
-        
-    channels = []
-    for line in raw_channels:
-        parts = line.split('|')
-        if len(parts) == 3:
-            # Name|ID|Hash
-            channels.append({
-                'name': parts[0], 
-                'id': int(parts[1]), 
-                'hash': int(parts[2])
-            })
-        elif len(parts) == 2:
-            # Name|ID (Legacy/Fallback)
-            channels.append({
-                'name': parts[0], 
-                'id': int(parts[1]), 
-                'hash': None
-            })
-        else:
-            # Name only
-            channels.append({'name': line, 'id': None, 'hash': None})
+    return [parse_channel_line(line) for line in raw_channels]
 
-    # Load existing news FIRST to determine offsets
-    existing_news = []
-    if os.path.exists(OUTPUT_FILE):
+def create_client():
+    load_telegram()
+    if SESSION_STRING:
+        return TelegramClient(StringSession(SESSION_STRING), int(API_ID), API_HASH)
+    print("Error: No SESSION_STRING provided.")
+    exit(1)
+
+async def resolve_channel_peers(client, channels):
+    # Fills id/access hash of name-only channels from the peer cache, resolving misses in one batch
+    peer_cache_path = cache_path_for(CHANNELS_FILE)
+    peer_cache = load_peer_cache(peer_cache_path)
+    resolved = await resolve_channels(client, channels, peer_cache)
+    if resolved:
+        save_peer_cache(peer_cache_path, peer_cache)
+        print(f"🔎 Resolved {resolved} channels (cached in {peer_cache_path})")
+    METRICS.add('peers_resolved', resolved)
+    return peer_cache_path, peer_cache
+
+def forget_stale_peers(peer_cache_path, peer_cache):
+    # Cached hashes Telegram rejected are resolved again next run
+    stale = STALE_PEERS & set(peer_cache)
+    if stale:
+        for name in stale:
+            del peer_cache[name]
+        save_peer_cache(peer_cache_path, peer_cache)
+        print(f"🔎 Dropped stale cached peers: {', '.join(sorted(stale))}")
+
+async def fetch_channel_pts(client, channels):
+    # {name: pts} of the resolved channels. A channel's pts moves with every new, edited or
+    # deleted message. Channels that fail (or come after a FloodWait) are left out.
+    semaphore = asyncio.Semaphore(max(1, args.channel_concurrency))
+    flooded = False
+
+    async def channel_pts(ch_info):
+        nonlocal flooded
+        async with semaphore:
+            if flooded:
+                return None
+            try:
+                full = await client(GetFullChannelRequest(build_channel_target(ch_info)))
+            except FloodWaitError as e:
+                flooded = True
+                print(f"🐢 FloodWait ({e.seconds}s) during the pre-check, running in full")
+                return None
+            except Exception as e:
+                print(f"Pre-check failed for {ch_info['name']}: {e}")
+                return None
+            return getattr(full.full_chat, 'pts', None)
+
+    resolved = [ch_info for ch_info in channels if ch_info['id'] and ch_info['hash']]
+    results = await asyncio.gather(*[channel_pts(ch_info) for ch_info in resolved])
+    return {ch_info['name']: pts for ch_info, pts in zip(resolved, results) if pts is not None}
+
+def nothing_changed(store, channels, channel_pts):
+    # True when a full run could only export the feed that is already on disk
+    known = store.channel_pts()
+    if any(channel_pts.get(ch['name']) is None or known.get(ch['name']) != channel_pts[ch['name']] for ch in channels):
+        return False
+    if store.pending_media() or store.unfinished_exports() or store.fetch_gaps():
+        return False
+    outputs = []
+    if args.output_mode in ('single', 'both'):
+        outputs.append(OUTPUT_FILE)
+    if args.output_mode in ('sharded', 'both'):
+        outputs.append(manifest_path_for(OUTPUT_FILE))
+    return all(os.path.exists(path) for path in outputs)
+
+async def main():
+    global MEDIA_POOL, FFMPEG_SLOTS, MEDIA_INDEX, RUN_DEADLINE, METRICS, PLANNER
+    METRICS = RunMetrics()
+    METRICS.lap('load')
+    FAILED_CHANNELS.clear()
+    FETCH_GAPS.clear()
+    # Jobs left by an earlier main() in the same process (benchmarks) are not this run's
+    DEFERRED_MEDIA.clear()
+    INTERRUPTED_MEDIA.clear()
+    MEDIA_ATTEMPTED.clear()
+    RECHECKED_CHANNELS.clear()
+    print(f"Starting fetch with: Channels={args.channels}, Output={args.output}, Limit={args.limit}")
+    
+    channels = load_channels()
+
+    # Open the incremental state store (one row per item next to the output).
+    # The legacy JSON is only parsed once, to seed an empty store.
+    os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
+    os.makedirs(MEDIA_DIR, exist_ok=True)
+    os.makedirs(work_dir_for(MEDIA_DIR), exist_ok=True)
+    MEDIA_INDEX = MediaIndex(index_path_for(MEDIA_DIR))
+    store = StateStore(state_path_for(OUTPUT_FILE))
+    if store.is_empty() and os.path.exists(OUTPUT_FILE):
         try:
             with open(OUTPUT_FILE, 'r', encoding='utf-8') as f:
-                existing_news = json.load(f)
-        except:
-            existing_news = []
-
-    # Calculate max ID per channel to use as min_id (High-Water Mark)
-    channel_max_ids = {}
-    for item in existing_news:
-        if 'source' in item and 'id' in item:
-            try:
-                # ID format is "channel_12345"
-                parts = item['id'].split('_')
-                if len(parts) >= 2:
-                    msg_id_num = int(parts[-1])
-                    src = item['source']
-                    if msg_id_num > channel_max_ids.get(src, 0):
-                        channel_max_ids[src] = msg_id_num
-            except:
-                pass
+                legacy_items = json.load(f)
+            imported = store.import_items(legacy_items)
+            MEDIA_INDEX.add_item_refs(item for item in legacy_items if 'id' in item)
+            print(f"📦 Seeded state store with {imported} items from {OUTPUT_FILE}")
+        except Exception as e:
+            print(f"Could not seed state store from {OUTPUT_FILE}: {e}")
+
+    # Max ID per channel to use as min_id (High-Water Mark)
+    channel_max_ids = store.high_water_marks()
+    fetch_gaps = store.fetch_gaps()
 
     try:
-        if SESSION_STRING:
-             client = TelegramClient(StringSession(SESSION_STRING), int(API_ID), API_HASH)
-        else:
-             print("Error: No SESSION_STRING provided.")
-             exit(1)
-             
+        METRICS.lap('connect')
+        client = create_client()
         await client.start()
         
+        # Name-only channels would otherwise cost a username resolve every run
+        METRICS.lap('resolve')
+        peer_cache_path, peer_cache = await resolve_channel_peers(client, channels)
+
+        # Cheap pre-check: one GetFullChannel per channel. When no channel's pts moved and
+        # nothing is left over from earlier runs, the feed on disk is current and the run
+        # stops before the media pipeline is even imported.
+        METRICS.lap('precheck')
+        channel_pts = {} if args.daemon or args.no_precheck else await fetch_channel_pts(client, channels)
+        if channel_pts and nothing_changed(store, channels, channel_pts):
+            print(f"💤 No changes in {len(channels)} channels since the last run, feed left as is")
+            METRICS.add('channels_unchanged', len(channels))
+            METRICS.lap()
+            METRICS.write(report_path_for(OUTPUT_FILE), status='unchanged', errors=DEBUG_ERRORS)
+            return
+        METRICS.lap('fetch')
+        load_media()
+        
         new_news = []
         start_time = time.time()
+        deadline = start_time + args.max_duration
         
-        for ch_info in channels:
-            # Check for Global Timeout / Stop Signal
-            if STOP_REQUESTED or (time.time() - start_time > args.max_duration):
-                print(f"⏳ Time limit ({args.max_duration}s) reached or stopped. Saving partial progress...")
-                break
-                
-            channel_name = ch_info['name']
-            
-            # ... (Existing channel setup) ...
-            
-            channel_id = ch_info['id']
-            channel_hash = ch_info['hash']
-            
-            # Smart Sync: Fetch only messages newer than what we have
-            min_id = channel_max_ids.get(channel_name, 0)
-            if min_id > 0:
-                print(f"🔄 Smart Sync for {channel_name}: Fetching only messages > {min_id}")
-            
-            # Construct Target
-            target = channel_name # Default
-            if channel_id and channel_hash:
-                target = InputPeerChannel(channel_id=channel_id, access_hash=channel_hash)
-            elif channel_id:
-                target = channel_id # Might fail without hash in fresh session but try anyway
-
-            items = await fetch_channel_news(client, target, channel_name, args.limit, min_id=min_id)
-            new_news.extend(items)
-            
-        print(f"Fetched {len(new_news)} items from Telegram.")
-
-        seen_ids = set()
-        merged_news = []
+        # Plan the run from costs measured in earlier runs: fetch/media work stops at
+        # work_deadline so merging and writing always fit, and starved channels go first
+        PLANNER = WorkPlanner(store.cost_stats(), deadline)
+        RUN_DEADLINE = PLANNER.work_deadline
+        ordered_channels = PLANNER.order_channels(channels, store.channel_rotation())
+        print(f"🗓️ Work budget {PLANNER.remaining():.0f}s (reserving {PLANNER.reserve:.0f}s for output)")
         
-        for item in new_news:
-            if item['id'] not in seen_ids:
-                merged_news.append(item)
-                seen_ids.add(item['id'])
-                
-        for item in existing_news:
-            if item.get('id') not in seen_ids and 'text' in item and 'date' in item:
-                # We do NOT filter by source here anymore, because we want to keep
-                # the existing news in this specific file intact.
-                # However, if we are splitting files, each file only contains ITS sources.
-                # So we SHOULD confirm the item belongs to one of the current channels?
-                # Actually, no. If a channel was removed from the list but exists in json, 
-                # we might want to keep it or drop it. 
-                # For safety in this split-file architecture, let's keep everything currently in the file.
-                merged_news.append(item)
-                seen_ids.add(item['id'])
+        # Media pipeline: message iteration -> bounded queue -> download workers -> CPU pool / ffmpeg
+        cpu_count = os.cpu_count() or 1
+        MEDIA_POOL = ProcessPoolExecutor(max_workers=cpu_count)
+        FFMPEG_SLOTS = asyncio.Semaphore(cpu_count)
+        media_workers_count = max(1, args.media_workers)
+        media_queue = asyncio.Queue(maxsize=media_workers_count * 4)
+        workers = [asyncio.create_task(media_worker(client, media_queue)) for _ in range(media_workers_count)]
         
-        merged_news.sort(key=lambda x: x['date'], reverse=True)
-        
-        # --- Volumetric Quota System ---
-        MAX_JSON_SIZE_MB = 10
-        MAX_REPO_MEDIA_SIZE_MB = 400
-        MAX_MEDIA_DIR_SIZE_BYTES = MAX_REPO_MEDIA_SIZE_MB * 1024 * 1024
+        # Fetch channels concurrently, capped by --channel-concurrency.
+        # gather() keeps the results in the planner's channel order, which is deterministic for a given state.
+        semaphore = asyncio.Semaphore(max(1, args.channel_concurrency))
+        try:
+            resumed_jobs = await resume_pending_media(client, store, channels)
+            # Stage 1: text, photos and video posters for every channel
+            results = await asyncio.gather(*[
+                fetch_channel_bounded(client, semaphore, ch_info, args.limit, channel_max_ids.get(ch_info['name'], 0), PLANNER.work_deadline, media_queue=media_queue,
+                                      gap=fetch_gaps.get(ch_info['name']))
+                for ch_info in ordered_channels
+            ])
+            # Edits and deletions among recent posts; media only re-runs where it changed
+            edited_items, deleted_ids = await reconcile_channels(client, store, ordered_channels, media_queue)
+            # Join media results back into the items before anything is written
+            if await wait_for_media(media_queue):
+                # Stage 2: deferred video transcodes (this run's first), then the backlog from earlier runs
+                for item, message, msg_id in DEFERRED_MEDIA + resumed_jobs:
+                    await media_queue.put((item, message, msg_id, 'full'))
+                await wait_for_media(media_queue)
+            else:
+                for item, _, _ in DEFERRED_MEDIA + resumed_jobs:
+                    INTERRUPTED_MEDIA[item['id']] = item
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # Jobs still queued when the workers stopped are retried next run
+            while not media_queue.empty():
+                item = media_queue.get_nowait()[0]
+                INTERRUPTED_MEDIA[item['id']] = item
+            MEDIA_POOL.shutdown()
+            MEDIA_POOL = None
         
-        # 1. Volumetric JSON Limit
-        # Calculate approximate byte size of the list in JSON. 
-        # If it exceeds the limit, pop the oldest items.
-        while True:
-            try:
-                # Use a fast estimation or precise json conversion
-                json_str = json.dumps(merged_news, ensure_ascii=False)
-                if len(json_str.encode('utf-8')) <= MAX_JSON_SIZE_MB * 1024 * 1024 or len(merged_news) == 0:
-                    break
-                merged_news.pop() # Remove the oldest
-            except Exception as e:
-                print(f"Error during JSON size check: {e}")
-                break
+        unfinished = []
+        for ch_info, (items, status) in zip(ordered_channels, results):
+            new_news.extend(items)
+            if status != 'done':
+                unfinished.append(f"{ch_info['name']} ({status})")
+        resumed_items = [job[0] for job in resumed_jobs]
+        new_news.extend(resumed_items)
+        new_news.extend(edited_items)
+        if deleted_ids:
+            deleted = set(deleted_ids)
+            new_news = [item for item in new_news if item['id'] not in deleted]
+            store.delete_items(deleted_ids)
+            store.clear_pending(deleted_ids)
+            MEDIA_INDEX.drop_refs(deleted_ids)
+        forget_stale_peers(peer_cache_path, peer_cache)
         
-        # Cleanup orphaned media files
-        # NOTE: With split files, multiple JSONs reference the same MEDIA_DIR.
-        # Removing orphans based on ONE json file is DANGEROUS because another JSON might need them.
-        # Solution: DISABLE strict orphan cleanup in disjoint runs, or run a separate 'cleanup' workflow.
-        # For now, I will COMMENT OUT orphan cleanup to prevent deleting valid media from other streams.
+        # Learn costs for the next run's plan
+        completed = [name for name, stats in METRICS.channels.items() if stats.get('status') == 'done']
+        store.mark_channels_completed(completed, time.time())
+        # Saved before the items move the high-water marks past the gaps
+        store.set_fetch_gaps(FETCH_GAPS)
+        cost_samples = {f"channel:{name}": METRICS.channels[name]['seconds'] for name in completed}
+        for kind in ('media:video', 'media:photo'):
+            job = METRICS.phases.get(f'job.{kind}')
+            if job:
+                cost_samples[kind] = job['seconds'] / job['calls']
+        if 'reconcile' in METRICS.phases:
+            cost_samples['reconcile'] = METRICS.phases['reconcile']['seconds']
+        store.update_costs(cost_samples, ewma)
         
-        # active_media = set()
-        # for item in merged_news:
-        #     if item.get('media'):
-        #         active_media.add(item['media'])
-        #     if item.get('poster'):
-        #         active_media.add(item['poster'])
-                
-        # # 1. ORPHAN CLEANUP
-        # for filename in os.listdir(MEDIA_DIR):
-        #     file_url = f"/media/{filename}"
-        #     if file_url and file_url not in active_media and not filename.startswith("temp_"):
-        #         try:
-        #             os.remove(os.path.join(MEDIA_DIR, filename))
-        #         except:
-        #             pass
+        # Remember media that didn't finish; resumed items that did are done
+        store.add_pending(INTERRUPTED_MEDIA.values(), MEDIA_ATTEMPTED)
+        store.clear_pending([item['id'] for item in resumed_items if item['id'] not in INTERRUPTED_MEDIA])
+        if INTERRUPTED_MEDIA:
+            print(f"⏸️ {len(INTERRUPTED_MEDIA)} media downloads deferred to the next run")
+        # Saved; the daemon's flushes only add what is interrupted from now on
+        INTERRUPTED_MEDIA.clear()
+        MEDIA_ATTEMPTED.clear()
         
-        # 2. GLOBAL SIZE SAFETY SWEEP (Fix for Cloudflare 25MB limit)
-        print("Running Global Size Safety Sweep...")
-        media_files = []
-        for filename in os.listdir(MEDIA_DIR):
-            file_path = os.path.join(MEDIA_DIR, filename)
-            if os.path.isfile(file_path):
-                try:
-                    file_size = os.path.getsize(file_path)
-                    media_files.append((file_path, file_size, os.path.getmtime(file_path)))
-                    # Check if single file > 22MB
-                    if file_size > 22 * 1024 * 1024: 
-                        print(f"⚠️ Safety Sweep: Deleting oversized existing file {filename} ({file_size // (1024*1024)} MB)")
-                        os.remove(file_path)
-                        # Remove it from our tracking list since it's deleted
-                        media_files.pop()
-                        
-                        file_web_path = f"/media/{filename}"
-                        for item in merged_news:
-                            if item.get('media') == file_web_path:
-                                item['media'] = None
-                                item['mediaType'] = None
-                            if item.get('poster') == file_web_path:
-                                item['poster'] = None
-                except Exception as e:
-                     print(f"Error checking file size {filename}: {e}")
+        if unfinished:
+            print(f"⏳ Time limit ({args.max_duration}s) reached or stopped. Saving partial progress...")
+            msg = f"Unfinished channels: {', '.join(unfinished)}"
+            print(msg)
+            DEBUG_ERRORS.append(msg)
+            
+        print(f"Fetched {len(new_news)} items from Telegram.")
 
-        # 3. VOLUMETRIC MEDIA LIMIT (Global Folder Quota)
-        # Sort remaining media files by modification time (oldest first)
-        media_files.sort(key=lambda x: x[2])
-        total_media_size = sum(f[1] for f in media_files)
+        export_feed(store, new_news)
+        # Channels read in full (new posts and re-check) are current as of the pts seen before the fetch
+        store.set_channel_pts({name: channel_pts[name] for name in completed
+                               if name in channel_pts and name not in FAILED_CHANNELS
+                               and (args.recheck_window <= 0 or name in RECHECKED_CHANNELS)})
         
-        deleted_media = set()
-        while total_media_size > MAX_MEDIA_DIR_SIZE_BYTES and media_files:
-            oldest_file = media_files.pop(0)
-            try:
-                os.remove(oldest_file[0])
-                total_media_size -= oldest_file[1]
-                filename = os.path.basename(oldest_file[0])
-                deleted_media.add(f"/media/{filename}")
-                print(f"🧹 Volumetric limit reached: Deleted older file {filename}")
-            except Exception as e:
-                print(f"Error deleting old media file {oldest_file[0]}: {e}")
-                
-        # Remove references to cleanly deleted media in the JSON
-        if deleted_media:
-            for item in merged_news:
-                if item.get('media') in deleted_media:
-                    item['media'] = None
-                    item['mediaType'] = None
-                if item.get('poster') in deleted_media:
-                    item['poster'] = None
-
-        # Write error log to a public file for debugging
-        error_log_path = os.path.join(os.path.dirname(OUTPUT_FILE), 'debug_errors.txt')
-        with open(error_log_path, 'w', encoding='utf-8') as f:
-            vahid_online_count = sum(1 for item in merged_news if item.get('source') == 'VahidOOnLine')
-            f.write(f"Stats: Total={len(merged_news)}, VahidOOnLine={vahid_online_count}\n")
-            f.write("--- Errors ---\n")
-            # We need to make sure DEBUG_ERRORS exists or use a local list if we couldn't add the global one
-            if 'DEBUG_ERRORS' in globals():
-                for err in DEBUG_ERRORS:
-                    f.write(f"{err}\n")
-            else:
-                f.write("DEBUG_ERRORS list not found (globals mismatch).\n")
-
-        os.makedirs(os.path.dirname(OUTPUT_FILE), exist_ok=True)
-        with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(merged_news, f, ensure_ascii=False, indent=2)
-            
-        print(f"Successfully saved {len(merged_news)} news items (merged) to {OUTPUT_FILE}")
+        if args.daemon:
+            await run_daemon(client, store, channels)
         
     except Exception as e:
         print(f"Critical Error: {e}")
@@ -575,11 +1442,76 @@ async def main():
                  f.write(f"\nCRITICAL FAILURE: {e}\n")
                  import traceback
                  traceback.print_exc(file=f)
-        except:
+            METRICS.lap()
+            METRICS.write(report_path_for(OUTPUT_FILE), status='failed', errors=DEBUG_ERRORS + [str(e)])
+        except Exception:
             pass
         exit(1)
     finally:
+        store.close()
+        MEDIA_INDEX.close()
         await client.disconnect()
 
+def run_gc():
+    # Deletes media that no feed sharing MEDIA_DIR references any more
+    os.makedirs(MEDIA_DIR, exist_ok=True)
+    feeds = args.feeds if args.feeds is not None else find_feed_files(os.path.dirname(OUTPUT_FILE))
+    for own_feed in (OUTPUT_FILE, manifest_path_for(OUTPUT_FILE)):
+        if os.path.exists(own_feed) and os.path.abspath(own_feed) not in map(os.path.abspath, feeds):
+            feeds.append(own_feed)
+    if not feeds:
+        print("Error: No feed JSON found, refusing to collect media.")
+        exit(1)
+    print(f"🧹 Media GC over {MEDIA_DIR} using feeds: {', '.join(feeds)}")
+    
+    index = MediaIndex(index_path_for(MEDIA_DIR))
+    try:
+        deleted, freed = collect_garbage(MEDIA_DIR, feeds, index=index, dry_run=args.dry_run, min_age=args.gc_min_age,
+                                         work_dir=work_dir_for(MEDIA_DIR))
+    except Exception as e:
+        print(f"Error: Media GC aborted, no files deleted: {e}")
+        exit(1)
+    finally:
+        index.close()
+    
+    verb = "Would delete" if args.dry_run else "Deleted"
+    for name in deleted:
+        print(f"  {verb} {name}")
+    print(f"{verb} {len(deleted)} unreferenced files ({freed / (1024*1024):.2f} MB)")
+
+async def run_resolve():
+    # Resolves every channel once and rewrites the channels file as Name|ID|Hash lines,
+    # so fresh checkouts (no peer cache) never need a username resolve either
+    channels = load_channels()
+    client = create_client()
+    try:
+        await client.start()
+        await resolve_channel_peers(client, channels)
+    finally:
+        await client.disconnect()
+    
+    unresolved = [ch['name'] for ch in channels if not ch['hash']]
+    with atomic_open(CHANNELS_FILE, 'w') as f:
+        f.write(''.join(f"{format_channel_line(ch)}\n" for ch in channels))
+    print(f"✅ Wrote {len(channels) - len(unresolved)} resolved channels to {CHANNELS_FILE}")
+    if unresolved:
+        print(f"Unresolved (kept as is): {', '.join(unresolved)}")
+
+def run(argv=None):
+    configure(argv)
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    if args.command in ('fetch', 'resolve') and (not API_ID or not API_HASH):
+        print("Error: TELEGRAM_API_ID and TELEGRAM_API_HASH must be set.")
+        exit(1)
+
+    if args.command == 'gc':
+        run_gc()
+    elif args.command == 'resolve':
+        asyncio.run(run_resolve())
+    else:
+        asyncio.run(main())
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    run()
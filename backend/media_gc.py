@@ -0,0 +1,99 @@
+# Reference-aware garbage collection for a MEDIA_DIR shared by several feeds.
+# A file is only deleted when no feed JSON (or sharded feed manifest) that uses the
+# directory references it through its 'media' or 'poster' fields.
+import glob
+import json
+import os
+import time
+
+from feed_shards import MANIFEST_NAME, is_manifest, read_sharded_items
+from media_index import item_file_names
+
+# Work files (in-flight downloads in the media dir, and everything in the work dir of
+# resumable partial downloads). They are only collected once nothing has touched
+# them for TEMP_MAX_AGE seconds.
+TEMP_PREFIXES = ('temp_',)
+TEMP_MAX_AGE = 24 * 3600
+
+
+def is_feed(data):
+    return isinstance(data, list) and all(isinstance(item, dict) and 'id' in item for item in data)
+
+
+def find_feed_files(feed_dir):
+    # Every JSON list-of-items in feed_dir is treated as a feed, and so is
+    # the manifest of every sharded feed directory next to it
+    feeds = []
+    candidates = sorted(glob.glob(os.path.join(feed_dir, '*.json')))
+    candidates += sorted(glob.glob(os.path.join(feed_dir, '*', MANIFEST_NAME)))
+    for path in candidates:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if is_feed(data) or is_manifest(data):
+                feeds.append(path)
+        except (OSError, ValueError):
+            continue
+    return feeds
+
+
+def live_media_names(feed_paths):
+    # Union of referenced file names. Raises if a feed can't be read: collecting
+    # against a partial view of the references would delete live media.
+    live = set()
+    for path in feed_paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if is_manifest(data):
+            data = read_sharded_items(path)
+        if not is_feed(data):
+            raise ValueError(f"{path} is not a feed JSON")
+        for item in data:
+            live.update(item_file_names(item))
+    return live
+
+
+def collect_garbage(media_dir, feed_paths, index=None, dry_run=False, min_age=600, work_dir=None):
+    # Returns (deleted_names, freed_bytes)
+    live = live_media_names(feed_paths)
+    now = time.time()
+    if index is not None:
+        # Written by a run whose feed isn't out yet (or was killed before it was)
+        live |= index.pending_names(now - TEMP_MAX_AGE)
+    garbage = []
+    freed = 0
+    for entry in os.scandir(media_dir):
+        if not entry.is_file() or entry.name in live:
+            continue
+        st = entry.stat()
+        max_age = TEMP_MAX_AGE if entry.name.startswith(TEMP_PREFIXES) else min_age
+        if now - st.st_mtime < max_age:
+            continue
+        garbage.append(entry.name)
+        freed += st.st_size
+
+    # Partial downloads abandoned for good (their item was dropped or already finished)
+    stale_work = []
+    if work_dir is not None and os.path.isdir(work_dir):
+        for entry in os.scandir(work_dir):
+            if not entry.is_file():
+                continue
+            st = entry.stat()
+            if now - st.st_mtime >= TEMP_MAX_AGE:
+                stale_work.append(entry.path)
+                freed += st.st_size
+
+    if not dry_run:
+        for path in stale_work:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        for name in garbage:
+            try:
+                os.remove(os.path.join(media_dir, name))
+            except FileNotFoundError:
+                pass
+        if index is not None:
+            index.remove_files(garbage)
+    return garbage + [os.path.relpath(path, media_dir) for path in stale_work], freed
@@ -0,0 +1,205 @@
+# Content-addressed media cache and file manifest shared by every feed that writes to MEDIA_DIR.
+# Media is keyed by Telegram's document/photo id, so a post forwarded between
+# channels reuses the file that was already downloaded and transcoded.
+# The files table tracks size/mtime/last use of every file as it is written, and
+# file_refs is the reverse index from a file to the items pointing at it, so quota
+# enforcement never has to rescan the directory or the feed.
+import json
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    key TEXT PRIMARY KEY,
+    media TEXT,
+    media_type TEXT,
+    poster TEXT,
+    variants TEXT
+);
+
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_files_last_used ON files (last_used);
+
+CREATE TABLE IF NOT EXISTS file_refs (
+    name TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    PRIMARY KEY (name, item_id)
+);
+CREATE INDEX IF NOT EXISTS idx_file_refs_item ON file_refs (item_id);
+
+-- Files written for items that no exported feed references yet (the run may still be
+-- going, or was killed before its feed was written). GC leaves them alone.
+CREATE TABLE IF NOT EXISTS pending_files (
+    name TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    written_at REAL NOT NULL,
+    PRIMARY KEY (name, item_id)
+);
+"""
+
+
+def index_path_for(media_dir):
+    # Kept beside (not inside) the media dir so it is never published or pruned with the files
+    return os.path.normpath(media_dir) + '.index.db'
+
+
+def work_dir_for(media_dir):
+    # Partial downloads (resumable across runs) live here, beside the media dir, so
+    # they are never published with it or counted against its size quota
+    return os.path.normpath(media_dir) + '.work'
+
+
+def media_key(message):
+    media = message.media
+    document = getattr(media, 'document', None)
+    if document is not None and getattr(document, 'id', None):
+        return f"doc:{document.id}"
+    photo = getattr(media, 'photo', None)
+    if photo is not None and getattr(photo, 'id', None):
+        return f"photo:{photo.id}"
+    return None
+
+
+def file_stem_for_key(key):
+    # "doc:123" -> "doc_123", used as the base name of the shared files
+    return key.replace(':', '_')
+
+
+def url_to_path(media_dir, url):
+    # "/media/foo.jpg" -> <media_dir>/foo.jpg
+    return os.path.join(media_dir, os.path.basename(url))
+
+
+def variant_urls(variants):
+    # URLs in an item's 'imageVariants' srcset strings ("/media/a_320.webp 320w, ...")
+    if not variants:
+        return []
+    return [entry.split(' ')[0] for srcset in variants['srcset'].values() for entry in srcset.split(', ')]
+
+
+def item_file_names(item):
+    # Files of the item and, for albums, of every album entry
+    names = []
+    for entry in [item] + (item.get('album') or []):
+        urls = [entry.get('media'), entry.get('poster')] + variant_urls(entry.get('imageVariants'))
+        names.extend(os.path.basename(url) for url in urls if url)
+    return names
+
+
+class MediaIndex:
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+        try:
+            # Indexes created before responsive image variants
+            self.conn.execute('ALTER TABLE media ADD COLUMN variants TEXT')
+        except sqlite3.OperationalError:
+            pass
+
+    def close(self):
+        self.conn.close()
+
+    def lookup(self, key, media_dir):
+        # Returns (media, media_type, poster, variants) if every file of the entry still exists
+        row = self.conn.execute('SELECT media, media_type, poster, variants FROM media WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        variants = json.loads(row[3]) if row[3] else None
+        for url in [row[0], row[2]] + variant_urls(variants):
+            if url and not os.path.exists(url_to_path(media_dir, url)):
+                return None
+        return row[0], row[1], row[2], variants
+
+    def record(self, key, media, media_type, poster, variants=None):
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO media (key, media, media_type, poster, variants) VALUES (?, ?, ?, ?, ?)',
+                (key, media, media_type, poster, json.dumps(variants) if variants else None),
+            )
+
+    # --- File manifest ---
+
+    def has_files(self):
+        return self.conn.execute('SELECT 1 FROM files LIMIT 1').fetchone() is not None
+
+    def rebuild_files(self, media_dir):
+        # One-time full scan, used to seed an empty manifest
+        rows = []
+        for entry in os.scandir(media_dir):
+            if entry.is_file() and not entry.name.startswith('temp_'):
+                st = entry.stat()
+                rows.append((entry.name, st.st_size, st.st_mtime, st.st_mtime))
+        with self.conn:
+            self.conn.execute('DELETE FROM files')
+            self.conn.executemany('INSERT INTO files (name, size, mtime, last_used) VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def track_files(self, media_dir, urls, item_id, now):
+        # Records files as they are written (or reused) and who references them
+        with self.conn:
+            for url in urls:
+                if not url:
+                    continue
+                name = os.path.basename(url)
+                try:
+                    st = os.stat(os.path.join(media_dir, name))
+                except FileNotFoundError:
+                    continue
+                self.conn.execute(
+                    'INSERT INTO files (name, size, mtime, last_used) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT(name) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, last_used = excluded.last_used',
+                    (name, st.st_size, st.st_mtime, now),
+                )
+                self.conn.execute('INSERT OR IGNORE INTO file_refs (name, item_id) VALUES (?, ?)', (name, item_id))
+                self.conn.execute('INSERT OR REPLACE INTO pending_files (name, item_id, written_at) VALUES (?, ?, ?)',
+                                  (name, item_id, now))
+
+    def commit_files(self, item_ids):
+        # The feed now references the files of item_ids
+        pending = {item_id for (item_id,) in self.conn.execute('SELECT DISTINCT item_id FROM pending_files')}
+        with self.conn:
+            self.conn.executemany('DELETE FROM pending_files WHERE item_id = ?',
+                                  [(item_id,) for item_id in pending if item_id in item_ids])
+
+    def pending_names(self, since):
+        return {name for (name,) in self.conn.execute('SELECT name FROM pending_files WHERE written_at >= ?', (since,))}
+
+    def add_item_refs(self, items):
+        # Registers references of items that were never processed through track_files (legacy feeds)
+        rows = [(name, item['id']) for item in items for name in item_file_names(item)]
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO file_refs (name, item_id) VALUES (?, ?)', rows)
+
+    def drop_refs(self, item_ids):
+        with self.conn:
+            self.conn.executemany('DELETE FROM file_refs WHERE item_id = ?', [(i,) for i in item_ids])
+            self.conn.executemany('DELETE FROM pending_files WHERE item_id = ?', [(i,) for i in item_ids])
+
+    def total_size(self):
+        return self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM files').fetchone()[0]
+
+    def oversized(self, max_bytes):
+        return self.conn.execute('SELECT name, size FROM files WHERE size > ?', (max_bytes,)).fetchall()
+
+    def iter_lru(self):
+        # Least recently used first (walks idx_files_last_used)
+        return self.conn.execute('SELECT name, size FROM files ORDER BY last_used ASC, name ASC')
+
+    def remove_files(self, names):
+        # Forgets deleted files and returns {item_id: set(names)} from the reverse index
+        affected = {}
+        with self.conn:
+            for name in names:
+                for (item_id,) in self.conn.execute('SELECT item_id FROM file_refs WHERE name = ?', (name,)):
+                    affected.setdefault(item_id, set()).add(name)
+                self.conn.execute('DELETE FROM file_refs WHERE name = ?', (name,))
+                self.conn.execute('DELETE FROM files WHERE name = ?', (name,))
+                self.conn.execute('DELETE FROM pending_files WHERE name = ?', (name,))
+        return affected
@@ -0,0 +1,97 @@
+# CPU-bound media helpers.
+# These live outside main.py so they can be shipped to the process pool
+# without re-running main.py's argument parsing in the workers.
+import base64
+import io
+import os
+
+from PIL import Image, ImageFilter
+
+from atomic_io import atomic_path
+
+try:
+    # Registers AVIF on Pillow builds that don't ship it
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+MAX_IMAGE_SIZE = 1200
+JPEG_QUALITY = 80
+
+# Responsive variants: <stem>_<width>.<format>, never wider than the source
+VARIANT_WIDTHS = (320, 640, 1200)
+VARIANT_QUALITY = {'webp': 75, 'avif': 55}
+AVIF_SPEED = 8
+PLACEHOLDER_SIZE = 16
+
+
+def supported_formats(formats):
+    # Variant formats this Pillow build can encode
+    Image.init()
+    return [fmt for fmt in formats if fmt in VARIANT_QUALITY and fmt.upper() in Image.SAVE]
+
+
+def compress_image(src_path, dst_path, max_size=MAX_IMAGE_SIZE, quality=JPEG_QUALITY, variant_stem=None, formats=()):
+    # Writes the JPEG (the fallback every client understands). With variant_stem,
+    # the responsive variants are rendered from the same decoded image; returns their description.
+    with Image.open(src_path) as img:
+        if img.mode in ("RGBA", "P", "CMYK"):
+            img = img.convert("RGB")
+        if img.width > max_size or img.height > max_size:
+            img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        # Written under a temporary name: an existence check is all that marks a file as done
+        with atomic_path(dst_path) as tmp:
+            img.save(tmp, "JPEG", quality=quality, optimize=True)
+        if variant_stem and formats:
+            return write_variants(img, variant_stem, formats)
+    return None
+
+
+def image_variants(src_path, variant_stem, formats):
+    # Variants for an already compressed JPEG (e.g. a poster written by an earlier run)
+    with Image.open(src_path) as img:
+        return write_variants(img, variant_stem, formats)
+
+
+def write_variants(img, variant_stem, formats, widths=VARIANT_WIDTHS):
+    # Largest first, each width resized from the previous one. Files that already exist are kept.
+    # Returns {'width', 'height', 'placeholder', 'files': {format: [[name, width], ...]}}
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    targets = sorted({min(width, img.width) for width in widths}, reverse=True)
+    files = {fmt: [] for fmt in formats}
+    current = img
+    for width in targets:
+        if current.width > width:
+            current = current.resize((width, max(1, round(img.height * width / img.width))), Image.Resampling.LANCZOS)
+        for fmt in formats:
+            path = f"{variant_stem}_{width}.{fmt}"
+            if not os.path.exists(path):
+                options = {'quality': VARIANT_QUALITY[fmt]}
+                if fmt == 'avif':
+                    options['speed'] = AVIF_SPEED
+                with atomic_path(path) as tmp:
+                    current.save(tmp, fmt.upper(), **options)
+            files[fmt].insert(0, [os.path.basename(path), width])
+    return {
+        'width': img.width,
+        'height': img.height,
+        'placeholder': placeholder(current),
+        'files': files,
+    }
+
+
+def placeholder(img):
+    # A tiny blurred image as a data URI, shown (scaled up) while the real image loads.
+    # WebP keeps it around 100 bytes; JPEG's headers alone are several hundred.
+    small = img.copy()
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    small = small.filter(ImageFilter.GaussianBlur(1))
+    buf = io.BytesIO()
+    if "WEBP" in Image.SAVE:
+        small.save(buf, "WEBP", quality=30)
+        mime = 'image/webp'
+    else:
+        small.save(buf, "JPEG", quality=50)
+        mime = 'image/jpeg'
+    return f'data:{mime};base64,' + base64.b64encode(buf.getvalue()).decode('ascii')
@@ -0,0 +1,114 @@
+# Near-duplicate clustering across channels.
+# Every item's cleaned text gets a 64-bit SimHash over its normalized words. Reposts of
+# the same story differ in a few words (a hashtag, a channel handle, a prefix), so their
+# hashes differ in a few bits. The hash is cut into BLOCKS blocks; two hashes at most
+# MAX_DISTANCE bits apart leave at least two blocks untouched, so they agree on at least
+# one pair of blocks. Every pair is a bucket key, and candidates come from an indexed
+# bucket lookup in the state store instead of a scan over the history.
+# A cluster is named after its first item, which is the one exported; see StateStore.iter_latest.
+# Clusters hold reposts across channels: an item never joins a cluster that already has an
+# item of its own channel, so a channel's follow-ups to its own story stay in the feed.
+import functools
+import hashlib
+import itertools
+from datetime import datetime
+
+from text_cleaner import normalize_tokens
+
+# Shorter texts ("📷", "فوری") would collide all the time
+MIN_TOKENS = 6
+# Word features rather than shingles: posts are short, and one added word changes
+# a shingle hash in several bits. Unrelated posts land 20+ bits apart.
+MAX_DISTANCE = 6
+BLOCKS = 8
+BLOCK_BITS = 8
+# Only reposts close in time are merged; recurring templated posts (daily prices etc.) aren't
+WINDOW_SECONDS = 48 * 3600
+
+HASH_BITS = BLOCKS * BLOCK_BITS
+BLOCK_MASK = (1 << BLOCK_BITS) - 1
+HASH_MASK = (1 << HASH_BITS) - 1
+# 28 keys of 16 bits each: a bucket holds ~1/65536 of the history
+BLOCK_PAIRS = list(itertools.combinations(range(BLOCKS), 2))
+
+
+# Per-bit counters: bit i of a token hash goes to a LANE_BITS-wide lane of one big int,
+# so a text's counts are a plain sum (posts are far below 2**16 words)
+LANE_BITS = 16
+LANE_MASK = (1 << LANE_BITS) - 1
+
+
+@functools.lru_cache(maxsize=65536)
+def token_lanes(token):
+    h = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+    return sum(1 << (bit * LANE_BITS) for bit in range(HASH_BITS) if h >> bit & 1)
+
+
+def simhash(text):
+    # 64-bit SimHash of the text, or None when it's too short to fingerprint
+    tokens = normalize_tokens(text)
+    if len(tokens) < MIN_TOKENS:
+        return None
+    counts = sum(map(token_lanes, tokens))
+    value = 0
+    for bit in range(HASH_BITS):
+        if (counts >> (bit * LANE_BITS) & LANE_MASK) * 2 > len(tokens):
+            value |= 1 << bit
+    return value
+
+
+def to_signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << HASH_BITS) if value >> (HASH_BITS - 1) else value
+
+
+def buckets(value):
+    # One key per block pair: pair number in the high bits, both blocks' values in the low ones
+    blocks = [(value >> (n * BLOCK_BITS)) & BLOCK_MASK for n in range(BLOCKS)]
+    return [pair << (2 * BLOCK_BITS) | blocks[i] << BLOCK_BITS | blocks[j] for pair, (i, j) in enumerate(BLOCK_PAIRS)]
+
+
+def distance(a, b):
+    return bin((a ^ b) & HASH_MASK).count('1')
+
+
+def item_time(item):
+    return datetime.fromisoformat(item['date']).timestamp()
+
+
+def cluster_items(store, items):
+    # Fingerprints items the store hasn't indexed yet, oldest first, and files each one
+    # under the cluster of its closest near-duplicate within the window (or its own cluster).
+    # Returns the number of items that joined an existing cluster.
+    rows = []
+    batch = {}   # bucket -> [(item_id, hash, cluster, time, source)] for this call's items
+    batch_sources = {}   # cluster -> sources of this call's items in it
+    joined = 0
+    for item in sorted(items, key=lambda i: (i['date'], i['id'])):
+        value = simhash(item['text'])
+        cluster = item['id']
+        keys = buckets(value) if value is not None else []
+        if keys:
+            when = item_time(item)
+            candidates = [(cand_id, cand_hash, cand_cluster, item_time({'date': cand_date}), cand_source)
+                          for cand_id, cand_hash, cand_cluster, cand_date, cand_source in store.fingerprint_candidates(keys)]
+            candidates += [entry for key in keys for entry in batch.get(key, [])]
+            matches = []
+            for cand_id, cand_hash, cand_cluster, cand_time, cand_source in candidates:
+                if cand_source == item['source'] or abs(when - cand_time) > WINDOW_SECONDS:
+                    continue
+                d = distance(value, cand_hash)
+                if d <= MAX_DISTANCE:
+                    matches.append((d, cand_cluster))
+            # Closest cluster without an item of this channel
+            for _, cand_cluster in sorted(set(matches)):
+                if item['source'] not in store.cluster_sources(cand_cluster) | batch_sources.get(cand_cluster, set()):
+                    cluster = cand_cluster
+                    joined += 1
+                    break
+            for key in keys:
+                batch.setdefault(key, []).append((item['id'], value, cluster, when, item['source']))
+        batch_sources.setdefault(cluster, set()).add(item['source'])
+        rows.append((item['id'], to_signed(value) if value is not None else None, cluster, keys))
+    store.add_fingerprints(rows)
+    return joined
@@ -0,0 +1,141 @@
+# Persistent peer cache for channel targets.
+# A name-only line in the channels file costs a username resolve RPC (slow and
+# heavily rate-limited) on every run, because StringSession keeps no entity cache.
+# Resolved ids and access hashes are kept in a JSON file next to the channels file,
+# and cache misses are resolved up front in one batch: the account's dialogs first
+# (up to 100 chats per request), then a bounded number of username resolves.
+import asyncio
+import json
+import os
+
+from atomic_io import atomic_open
+
+# Dialogs scanned per batch resolve (100 per request)
+DIALOG_SCAN_LIMIT = 500
+RESOLVE_CONCURRENCY = 4
+
+
+def cache_path_for(channels_file):
+    # "config.txt" -> "config.peers.json"
+    base, _ = os.path.splitext(channels_file)
+    return base + '.peers.json'
+
+
+def load_peer_cache(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_peer_cache(path, cache):
+    with atomic_open(path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
+
+def parse_channel_line(line):
+    parts = line.split('|')
+    if len(parts) == 3:
+        # Name|ID|Hash
+        return {'name': parts[0], 'id': int(parts[1]), 'hash': int(parts[2])}
+    if len(parts) == 2:
+        # Name|ID (Legacy/Fallback)
+        return {'name': parts[0], 'id': int(parts[1]), 'hash': None}
+    # Name only
+    return {'name': line, 'id': None, 'hash': None}
+
+
+def format_channel_line(ch_info):
+    if ch_info['id'] and ch_info['hash']:
+        return f"{ch_info['name']}|{ch_info['id']}|{ch_info['hash']}"
+    if ch_info['id']:
+        return f"{ch_info['name']}|{ch_info['id']}"
+    return ch_info['name']
+
+
+def apply_peer_cache(channels, cache):
+    # Fills id/hash of channels the cache knows. Returns the channels still unresolved.
+    missing = []
+    for ch_info in channels:
+        if ch_info['hash']:
+            continue
+        peer = cache.get(ch_info['name'])
+        if peer and (ch_info['id'] is None or ch_info['id'] == peer['id']):
+            ch_info['id'] = peer['id']
+            ch_info['hash'] = peer['hash']
+        else:
+            missing.append(ch_info)
+    return missing
+
+
+async def resolve_from_dialogs(client, missing):
+    # One pass over the account's dialogs matches channels by username or id
+    by_username = {ch['name'].lower(): ch for ch in missing}
+    by_id = {ch['id']: ch for ch in missing if ch['id']}
+    resolved = []
+    async for dialog in client.iter_dialogs(limit=DIALOG_SCAN_LIMIT):
+        entity = dialog.entity
+        access_hash = getattr(entity, 'access_hash', None)
+        if access_hash is None:
+            continue
+        ch_info = by_id.get(entity.id) or by_username.get((getattr(entity, 'username', None) or '').lower())
+        if ch_info is None or ch_info['hash']:
+            continue
+        ch_info['id'] = entity.id
+        ch_info['hash'] = access_hash
+        resolved.append(ch_info)
+    return resolved
+
+
+async def resolve_by_username(client, missing):
+    # Username resolves for whatever the dialogs didn't cover; stops at the first FloodWait
+    from telethon.errors import FloodWaitError
+    semaphore = asyncio.Semaphore(RESOLVE_CONCURRENCY)
+    flooded = False
+
+    async def resolve(ch_info):
+        nonlocal flooded
+        async with semaphore:
+            if flooded:
+                return None
+            try:
+                peer = await client.get_input_entity(ch_info['name'])
+            except FloodWaitError as e:
+                flooded = True
+                print(f"🐢 FloodWait ({e.seconds}s) while resolving channels, leaving the rest for later")
+                return None
+            except Exception as e:
+                print(f"Could not resolve channel {ch_info['name']}: {e}")
+                return None
+            if getattr(peer, 'channel_id', None) is None:
+                # Not a channel (e.g. a user or a basic group)
+                return None
+            ch_info['id'] = peer.channel_id
+            ch_info['hash'] = peer.access_hash
+            return ch_info
+
+    results = await asyncio.gather(*[resolve(ch_info) for ch_info in missing])
+    return [ch_info for ch_info in results if ch_info is not None]
+
+
+async def resolve_channels(client, channels, cache):
+    # Fills id/hash for every channel it can, updating the cache in place.
+    # Returns the number of channels resolved over the network.
+    missing = apply_peer_cache(channels, cache)
+    if not missing:
+        return 0
+    # Imported here so that reading the channels file doesn't load Telethon
+    from telethon.errors import FloodWaitError
+    resolved = []
+    try:
+        resolved += await resolve_from_dialogs(client, missing)
+    except FloodWaitError as e:
+        print(f"🐢 FloodWait ({e.seconds}s) while listing dialogs")
+    except Exception as e:
+        print(f"Could not list dialogs: {e}")
+    resolved += await resolve_by_username(client, [ch for ch in missing if not ch['hash']])
+    for ch_info in resolved:
+        cache[ch_info['name']] = {'id': ch_info['id'], 'hash': ch_info['hash']}
+    return len(resolved)
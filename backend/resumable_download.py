@@ -0,0 +1,117 @@
+# Chunked, resumable downloads for large media.
+# Data goes to "<path>.part" and progress to "<path>.part.json", so a download cut
+# off by the deadline or SIGTERM continues from the saved offsets on the next run.
+# Large files are split into segments that download in parallel.
+import asyncio
+import json
+import math
+import os
+
+from atomic_io import atomic_open
+
+PART_SUFFIX = '.part'
+STATE_SUFFIX = '.part.json'
+# Telegram's maximum request size; offsets stay aligned to it
+REQUEST_SIZE = 512 * 1024
+# Files are only split when every segment gets at least this much
+MIN_SEGMENT_SIZE = 4 * 1024 * 1024
+PARALLEL_SEGMENTS = 4
+
+
+class DownloadInterrupted(Exception):
+    # Raised when a download stops early; the .part file and its state are kept for the next run
+    pass
+
+
+def plan_segments(size, parallel=PARALLEL_SEGMENTS):
+    # [[start, end, done], ...] with starts aligned to REQUEST_SIZE
+    count = max(1, min(parallel, size // MIN_SEGMENT_SIZE))
+    chunks = math.ceil(size / REQUEST_SIZE)
+    per_segment = math.ceil(chunks / count) * REQUEST_SIZE
+    segments = []
+    start = 0
+    while start < size:
+        end = min(size, start + per_segment)
+        segments.append([start, end, 0])
+        start = end
+    return segments
+
+
+def load_state(state_path, size):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get('size') != size:
+        return None
+    return state
+
+
+def save_state(state_path, state):
+    # Saved after every chunk: replaced atomically (a torn state would throw the .part away),
+    # but not fsynced, which would stall every chunk
+    with atomic_open(state_path, 'w', durable=False, encoding='utf-8') as f:
+        json.dump(state, f)
+
+
+def discard_partial(path):
+    for suffix in (PART_SUFFIX, STATE_SUFFIX):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+async def download_resumable(client, file, path, size, parallel=PARALLEL_SEGMENTS, should_stop=None):
+    # Downloads `file` (a Telegram document) to `path`. Returns path when complete,
+    # raises DownloadInterrupted when stopped or failed part-way.
+    part_path = path + PART_SUFFIX
+    state_path = path + STATE_SUFFIX
+
+    state = load_state(state_path, size) if os.path.exists(part_path) else None
+    if state is None:
+        state = {'size': size, 'segments': plan_segments(size, parallel)}
+        with open(part_path, 'wb') as f:
+            f.truncate(size)
+        save_state(state_path, state)
+    else:
+        done = sum(seg[2] for seg in state['segments'])
+        print(f"  ⏯️ Resuming {os.path.basename(path)} at {done / (1024*1024):.1f}/{size / (1024*1024):.1f} MB")
+
+    stopped = False
+
+    with open(part_path, 'r+b') as f:
+        async def fetch_segment(seg):
+            nonlocal stopped
+            start, end, _ = seg
+            remaining = end - start - seg[2]
+            if remaining <= 0:
+                return
+            async for chunk in client.iter_download(
+                    file, offset=start + seg[2], request_size=REQUEST_SIZE,
+                    limit=math.ceil(remaining / REQUEST_SIZE), file_size=size):
+                chunk = chunk[:end - start - seg[2]]
+                # No await between seek and write, so segments can share the handle
+                f.seek(start + seg[2])
+                f.write(chunk)
+                f.flush()
+                seg[2] += len(chunk)
+                save_state(state_path, state)
+                if seg[2] >= end - start:
+                    break
+                if stopped or (should_stop and should_stop()):
+                    stopped = True
+                    break
+
+        results = await asyncio.gather(*(fetch_segment(seg) for seg in state['segments']), return_exceptions=True)
+
+    errors = [r for r in results if isinstance(r, Exception)]
+    complete = all(seg[2] >= seg[1] - seg[0] for seg in state['segments'])
+    if not complete:
+        save_state(state_path, state)
+        reason = f"error: {errors[0]}" if errors else "stopped"
+        # The first error is kept as the cause, so callers can tell a FloodWait from a stop
+        raise DownloadInterrupted(f"{os.path.basename(path)} {reason}") from (errors[0] if errors else None)
+
+    os.replace(part_path, path)
+    os.remove(state_path)
+    return path
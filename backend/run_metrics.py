@@ -0,0 +1,65 @@
+# Per-run instrumentation: phase timings, counters and per-channel stats,
+# written as a JSON run report next to the feed output.
+import json
+import time
+from contextlib import contextmanager
+
+from atomic_io import atomic_open
+
+
+def report_path_for(output_file):
+    base = output_file[:-5] if output_file.endswith('.json') else output_file
+    return base + '.run_report.json'
+
+
+class RunMetrics:
+    def __init__(self):
+        self.started_at = time.time()
+        self.phases = {}
+        self.counters = {}
+        self.channels = {}
+        self._lap_name = None
+        self._lap_start = None
+
+    @contextmanager
+    def phase(self, name):
+        # Cumulative wall time per phase; concurrent phases (e.g. downloads) overlap
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        entry = self.phases.setdefault(name, {'calls': 0, 'seconds': 0.0})
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+
+    def lap(self, name=None):
+        # For sequential phases: closes the running lap (if any) and starts `name`
+        now = time.perf_counter()
+        if self._lap_name:
+            self.record(self._lap_name, now - self._lap_start)
+        self._lap_name, self._lap_start = name, now
+
+    def add(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def channel(self, name, **fields):
+        self.channels.setdefault(name, {}).update(fields)
+
+    def report(self, **extra):
+        report = {
+            'started_at': self.started_at,
+            'wall_seconds': round(time.time() - self.started_at, 3),
+            'phases': {name: {'calls': p['calls'], 'seconds': round(p['seconds'], 4)}
+                       for name, p in sorted(self.phases.items())},
+            'counters': dict(sorted(self.counters.items())),
+            'channels': self.channels,
+        }
+        report.update(extra)
+        return report
+
+    def write(self, path, **extra):
+        with atomic_open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(**extra), f, ensure_ascii=False, indent=2)
@@ -0,0 +1,135 @@
+# Client-side search index, written next to the feed.
+#   search/index.json         prefixes present, doc shard files, format parameters
+#   search/tokens/<hex>.json  {token: [ordinal deltas]} for tokens starting with one PREFIX_LENGTH prefix
+#   search/docs/<n>.json      item ids of ordinals n*DOCS_PER_SHARD..; null where the item left the feed
+# Tokens are normalize_tokens() of the item text, so clients normalize queries the same way.
+# Every exported item gets a stable ordinal the first time it's indexed; the postings live in
+# the state store, so a run only re-tokenizes new and edited items, drops the ones that left
+# the feed and rewrites the files those changes touched.
+import datetime
+import json
+import os
+
+from atomic_io import atomic_write, remove_quietly
+from feed_shards import encode_compact, shard_dir_for
+from text_cleaner import normalize_tokens
+
+SEARCH_SUBDIR = 'search'
+INDEX_NAME = 'index.json'
+PREFIX_LENGTH = 2
+MIN_TOKEN_LENGTH = 2
+DOCS_PER_SHARD = 1000
+INDEX_VERSION = 1
+
+
+def search_dir_for(output):
+    # "news.json" -> "news/search/"
+    return os.path.join(shard_dir_for(output), SEARCH_SUBDIR)
+
+
+def item_tokens(item):
+    return sorted({token for token in normalize_tokens(item.get('text')) if len(token) >= MIN_TOKEN_LENGTH})
+
+
+def token_prefix(token):
+    return token[:PREFIX_LENGTH]
+
+
+def prefix_file(prefix):
+    # Codepoints keep the file names ASCII: "اب" -> "tokens/627-628.json"
+    return 'tokens/' + '-'.join(f'{ord(c):x}' for c in prefix) + '.json'
+
+
+def doc_file(shard):
+    return f'docs/{shard}.json'
+
+
+def delta_encode(ordinals):
+    deltas = []
+    previous = 0
+    for ordinal in ordinals:
+        deltas.append(ordinal - previous)
+        previous = ordinal
+    return deltas
+
+
+def load_index(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        return index if isinstance(index, dict) and index.get('version') == INDEX_VERSION else None
+    except (OSError, ValueError):
+        return None
+
+
+def update_search_index(store, out_dir, items, touched_ids, rebuild=False):
+    # items: the exported feed; touched_ids: ids whose text may have changed this run.
+    # rebuild rewrites every file (the store may be ahead of them after an interrupted export).
+    # Returns (files_written, bytes_written).
+    for subdir in ('tokens', 'docs'):
+        os.makedirs(os.path.join(out_dir, subdir), exist_ok=True)
+    index_path = os.path.join(out_dir, INDEX_NAME)
+    previous = load_index(index_path)
+
+    indexed = store.search_ordinals()
+    exported = {item['id'] for item in items}
+    removed = [item_id for item_id in indexed if item_id not in exported]
+    changed = [item for item in items if item['id'] not in indexed or item['id'] in touched_ids]
+
+    dirty_tokens, dirty_ordinals = store.remove_search_documents(removed)
+    tokens, ordinals = store.replace_search_documents([(item['id'], item_tokens(item)) for item in changed])
+    dirty_tokens |= tokens
+    dirty_ordinals |= ordinals
+    dirty_prefixes = {token_prefix(token) for token in dirty_tokens}
+    dirty_shards = {ordinal // DOCS_PER_SHARD for ordinal in dirty_ordinals}
+    if previous is None or rebuild:
+        # First index, its files are gone or can't be trusted: write everything
+        dirty_prefixes = set(store.search_prefixes(PREFIX_LENGTH))
+        dirty_shards = set(store.search_doc_shards(DOCS_PER_SHARD))
+
+    prefixes = set(previous['prefixes']) if previous else set()
+    shards = set(previous['docShards']) if previous else set()
+    written = 0
+    written_bytes = 0
+    for prefix in dirty_prefixes:
+        path = os.path.join(out_dir, prefix_file(prefix))
+        postings = {}
+        for token, ordinal in store.search_postings(prefix):
+            postings.setdefault(token, []).append(ordinal)
+        if not postings:
+            remove_quietly(path)
+            prefixes.discard(prefix)
+            continue
+        written_bytes += atomic_write(path, encode_compact({token: delta_encode(ords) for token, ords in postings.items()}))
+        written += 1
+        prefixes.add(prefix)
+    for shard in dirty_shards:
+        path = os.path.join(out_dir, doc_file(shard))
+        first = shard * DOCS_PER_SHARD
+        ids = [None] * DOCS_PER_SHARD
+        for ordinal, item_id in store.search_docs(first, first + DOCS_PER_SHARD):
+            ids[ordinal - first] = item_id
+        while ids and ids[-1] is None:
+            ids.pop()
+        if not ids:
+            remove_quietly(path)
+            shards.discard(shard)
+            continue
+        written_bytes += atomic_write(path, encode_compact(ids))
+        written += 1
+        shards.add(shard)
+
+    if previous is None or dirty_prefixes or dirty_shards:
+        index = {
+            'version': INDEX_VERSION,
+            'generated_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'prefixLength': PREFIX_LENGTH,
+            'minTokenLength': MIN_TOKEN_LENGTH,
+            'docsPerShard': DOCS_PER_SHARD,
+            'documents': len(exported),
+            'prefixes': sorted(prefixes),
+            'docShards': sorted(shards),
+        }
+        written_bytes += atomic_write(index_path, json.dumps(index, ensure_ascii=False, indent=2).encode('utf-8'))
+        written += 1
+    return written, written_bytes
@@ -0,0 +1,468 @@
+# Local SQLite state store for a feed.
+# One row per news item, indexed by (source, msg_id) and date. The public
+# JSON file is exported from here instead of being re-parsed every run.
+import json
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    msg_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_items_source_msg ON items (source, msg_id);
+CREATE INDEX IF NOT EXISTS idx_items_date ON items (date);
+
+-- High-water mark per channel. Kept separately so evicting old items
+-- never moves a channel's min_id backwards.
+CREATE TABLE IF NOT EXISTS watermarks (
+    source TEXT PRIMARY KEY,
+    max_msg_id INTEGER NOT NULL
+);
+
+-- Messages a run stopped mid-channel didn't reach: newer ones already moved the
+-- high-water mark, so (min_id, max_id) is read on its own by the next run
+CREATE TABLE IF NOT EXISTS fetch_gaps (
+    source TEXT PRIMARY KEY,
+    min_id INTEGER NOT NULL,
+    max_id INTEGER NOT NULL,
+    remaining INTEGER NOT NULL
+);
+
+-- Items whose media didn't finish (deadline/stop); retried on the next runs
+CREATE TABLE IF NOT EXISTS pending_media (
+    item_id TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    msg_id INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+
+-- Cost estimates learned from earlier runs (see work_planner.py)
+CREATE TABLE IF NOT EXISTS cost_stats (
+    key TEXT PRIMARY KEY,
+    seconds REAL NOT NULL,
+    samples INTEGER NOT NULL
+);
+
+-- Hash of the Telegram message behind each item (text, link, media), used to
+-- detect edits when recent posts are re-checked. media_key tells whether the media changed.
+CREATE TABLE IF NOT EXISTS content_hashes (
+    item_id TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    media_key TEXT
+);
+
+-- Near-duplicate index (see near_dupes.py): one row per item, simhash is NULL for texts
+-- too short to fingerprint. cluster is the id of the cluster's first item.
+CREATE TABLE IF NOT EXISTS fingerprints (
+    item_id TEXT PRIMARY KEY,
+    simhash INTEGER,
+    cluster TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fingerprints_cluster ON fingerprints (cluster);
+CREATE TABLE IF NOT EXISTS fingerprint_buckets (
+    bucket INTEGER NOT NULL,
+    item_id TEXT NOT NULL,
+    PRIMARY KEY (bucket, item_id)
+) WITHOUT ROWID;
+
+-- Client search index (see search_index.py): a stable ordinal per indexed item, never
+-- reused, and its postings. The item's tokens are kept with it (space separated), so
+-- postings need no second index to be removed.
+CREATE TABLE IF NOT EXISTS search_docs (
+    ordinal INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_id TEXT NOT NULL UNIQUE,
+    tokens TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_postings (
+    token TEXT NOT NULL,
+    ordinal INTEGER NOT NULL,
+    PRIMARY KEY (token, ordinal)
+) WITHOUT ROWID;
+
+-- Channel pts (Telegram's per-channel update counter) as of the last run that read the
+-- channel in full; the start-up pre-check compares it with the current one
+CREATE TABLE IF NOT EXISTS channel_pts (
+    source TEXT PRIMARY KEY,
+    pts INTEGER NOT NULL
+);
+
+-- When each channel last finished a fetch, for fair rotation
+CREATE TABLE IF NOT EXISTS channel_rotation (
+    source TEXT PRIMARY KEY,
+    last_completed_at REAL NOT NULL
+);
+
+-- Export commit journal. A generation is opened before an export touches any file and
+-- committed once the feed is written; media deletions are journaled before they happen,
+-- so a run killed in between can roll them forward instead of rebuilding everything.
+CREATE TABLE IF NOT EXISTS export_journal (
+    generation INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    deleted_files TEXT NOT NULL DEFAULT '[]',
+    committed_at REAL
+);
+"""
+
+# Committed journal entries kept for inspection
+JOURNAL_KEEP = 20
+
+
+def state_path_for(output_file):
+    base, _ = os.path.splitext(output_file)
+    return base + '.state.db'
+
+
+def parse_msg_id(item_id):
+    # ID format is "channel_12345"
+    try:
+        return int(item_id.rsplit('_', 1)[-1])
+    except (ValueError, AttributeError):
+        return 0
+
+
+class StateStore:
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def is_empty(self):
+        return self.conn.execute('SELECT 1 FROM items LIMIT 1').fetchone() is None
+
+    def high_water_marks(self):
+        return dict(self.conn.execute('SELECT source, max_msg_id FROM watermarks'))
+
+    def fetch_gaps(self):
+        return {source: (min_id, max_id, remaining) for source, min_id, max_id, remaining
+                in self.conn.execute('SELECT source, min_id, max_id, remaining FROM fetch_gaps')}
+
+    def set_fetch_gaps(self, gaps):
+        # {source: (min_id, max_id, remaining)}; None closes the channel's gap
+        with self.conn:
+            for source, gap in gaps.items():
+                if gap is None or gap[2] <= 0:
+                    self.conn.execute('DELETE FROM fetch_gaps WHERE source = ?', (source,))
+                else:
+                    self.conn.execute('INSERT OR REPLACE INTO fetch_gaps (source, min_id, max_id, remaining) VALUES (?, ?, ?, ?)',
+                                      (source, *gap))
+
+    def upsert_items(self, items):
+        # Newer copies of an item replace the stored one (same rule as the old in-memory merge)
+        rows = []
+        marks = {}
+        for item in items:
+            msg_id = parse_msg_id(item['id'])
+            rows.append((item['id'], item['source'], msg_id, item['date'], json.dumps(item, ensure_ascii=False)))
+            if msg_id > marks.get(item['source'], 0):
+                marks[item['source']] = msg_id
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO items (id, source, msg_id, date, data) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET source = excluded.source, msg_id = excluded.msg_id, '
+                'date = excluded.date, data = excluded.data',
+                rows,
+            )
+            self.conn.executemany(
+                'INSERT INTO watermarks (source, max_msg_id) VALUES (?, ?) '
+                'ON CONFLICT(source) DO UPDATE SET max_msg_id = MAX(max_msg_id, excluded.max_msg_id)',
+                marks.items(),
+            )
+        return len(rows)
+
+    def import_items(self, items):
+        # One-time migration from a legacy JSON feed
+        valid = [item for item in items if 'id' in item and 'source' in item and 'text' in item and 'date' in item]
+        return self.upsert_items(valid)
+
+    def delete_items(self, item_ids):
+        with self.conn:
+            self.conn.executemany('DELETE FROM items WHERE id = ?', [(i,) for i in item_ids])
+            self.conn.executemany('DELETE FROM content_hashes WHERE item_id = ?', [(i,) for i in item_ids])
+            self.conn.executemany('DELETE FROM fingerprints WHERE item_id = ?', [(i,) for i in item_ids])
+            self._repair_clusters()
+
+    def delete_after(self, date, item_id):
+        # Drops everything that sorts after (date, item_id) in iter_latest order.
+        # Returns the deleted ids.
+        where = 'date < ? OR (date = ? AND id > ?)'
+        params = (date, date, item_id)
+        with self.conn:
+            ids = [row[0] for row in self.conn.execute(f'SELECT id FROM items WHERE {where}', params)]
+            self.conn.execute(f'DELETE FROM items WHERE {where}', params)
+            self.conn.execute('DELETE FROM content_hashes WHERE item_id NOT IN (SELECT id FROM items)')
+            self.conn.execute('DELETE FROM fingerprints WHERE item_id NOT IN (SELECT id FROM items)')
+            self._repair_clusters()
+        return ids
+
+    def delete_all(self):
+        with self.conn:
+            ids = [row[0] for row in self.conn.execute('SELECT id FROM items')]
+            self.conn.execute('DELETE FROM items')
+            self.conn.execute('DELETE FROM content_hashes')
+            self.conn.execute('DELETE FROM fingerprints')
+            self.conn.execute('DELETE FROM fingerprint_buckets')
+        return ids
+
+    def get_items(self, item_ids):
+        items = {}
+        for item_id in item_ids:
+            row = self.conn.execute('SELECT data FROM items WHERE id = ?', (item_id,)).fetchone()
+            if row:
+                items[item_id] = json.loads(row[0])
+        return items
+
+    def set_content_hashes(self, hashes):
+        # hashes: {item_id: (hash, media_key)}
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO content_hashes (item_id, hash, media_key) VALUES (?, ?, ?)',
+                [(item_id, h, key) for item_id, (h, key) in hashes.items()],
+            )
+
+    def recheck_window(self, source, size):
+        # The channel's newest stored posts: [(item_id, msg_id, hash, media_key)]; hash is None
+        # for items stored before hashing
+        return self.conn.execute(
+            'SELECT i.id, i.msg_id, h.hash, h.media_key FROM items i '
+            'LEFT JOIN content_hashes h ON h.item_id = i.id '
+            'WHERE i.source = ? ORDER BY i.msg_id DESC LIMIT ?',
+            (source, size),
+        ).fetchall()
+
+    def unclustered_items(self):
+        # Items not in the near-duplicate index yet (new ones, or everything on first use)
+        return [json.loads(data) for (data,) in self.conn.execute(
+            'SELECT i.data FROM items i LEFT JOIN fingerprints f ON f.item_id = i.id WHERE f.item_id IS NULL'
+        )]
+
+    def fingerprint_candidates(self, buckets):
+        # [(item_id, simhash, cluster, date, source)] of indexed items sharing a bucket
+        marks = ','.join('?' * len(buckets))
+        return self.conn.execute(
+            'SELECT DISTINCT f.item_id, f.simhash, f.cluster, i.date, i.source FROM fingerprint_buckets b '
+            'JOIN fingerprints f ON f.item_id = b.item_id JOIN items i ON i.id = b.item_id '
+            f'WHERE b.bucket IN ({marks})',
+            buckets,
+        ).fetchall()
+
+    def cluster_sources(self, cluster):
+        return {source for (source,) in self.conn.execute(
+            'SELECT i.source FROM fingerprints f JOIN items i ON i.id = f.item_id WHERE f.cluster = ?', (cluster,))}
+
+    def forget_fingerprints(self, item_ids):
+        # Edited items leave the index and their clusters, and are fingerprinted
+        # again as unclustered items
+        if not item_ids:
+            return
+        with self.conn:
+            self.conn.executemany('DELETE FROM fingerprints WHERE item_id = ?', [(i,) for i in item_ids])
+            self._repair_clusters()
+
+    def add_fingerprints(self, rows):
+        # rows: [(item_id, simhash, cluster, buckets)]
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO fingerprints (item_id, simhash, cluster) VALUES (?, ?, ?)',
+                [(item_id, value, cluster) for item_id, value, cluster, _ in rows],
+            )
+            self.conn.executemany(
+                'INSERT INTO fingerprint_buckets (bucket, item_id) VALUES (?, ?)',
+                sorted((bucket, item_id) for item_id, _, _, keys in rows for bucket in keys),
+            )
+            # An item older than the cluster's first one (an edited item re-joining, or one
+            # from a filled gap) takes over its name
+            for cluster in {cluster for item_id, _, cluster, _ in rows if cluster != item_id}:
+                self._promote_first(cluster)
+
+    def _repair_clusters(self):
+        # Bucket rows are keyed for lookup, so removed items are swept in one pass.
+        # A cluster whose first item was removed is taken over by its oldest remaining item.
+        self.conn.execute('DELETE FROM fingerprint_buckets WHERE item_id NOT IN (SELECT item_id FROM fingerprints)')
+        orphaned = [row[0] for row in self.conn.execute(
+            'SELECT DISTINCT cluster FROM fingerprints WHERE cluster NOT IN (SELECT item_id FROM fingerprints)'
+        )]
+        for cluster in orphaned:
+            self._promote_first(cluster)
+
+    def _promote_first(self, cluster):
+        (first,) = self.conn.execute(
+            'SELECT f.item_id FROM fingerprints f JOIN items i ON i.id = f.item_id '
+            'WHERE f.cluster = ? ORDER BY i.date, i.id LIMIT 1',
+            (cluster,),
+        ).fetchone()
+        if first != cluster:
+            self.conn.execute('UPDATE fingerprints SET cluster = ? WHERE cluster = ?', (first, cluster))
+
+    def cluster_copies(self):
+        # {cluster: [{'source', 'link', 'date'}, ...]} for the later copies of every cluster, oldest first
+        copies = {}
+        for cluster, data in self.conn.execute(
+            'SELECT f.cluster, i.data FROM fingerprints f JOIN items i ON i.id = f.item_id '
+            'WHERE f.cluster != f.item_id ORDER BY i.date, i.id'
+        ):
+            item = json.loads(data)
+            copies.setdefault(cluster, []).append({'source': item['source'], 'link': item.get('link'), 'date': item['date']})
+        return copies
+
+    def search_ordinals(self):
+        return dict(self.conn.execute('SELECT item_id, ordinal FROM search_docs'))
+
+    def remove_search_documents(self, item_ids):
+        # Returns the (tokens, ordinals) the removal touched
+        tokens = set()
+        ordinals = set()
+        postings = []
+        with self.conn:
+            for item_id in item_ids:
+                row = self.conn.execute('SELECT ordinal, tokens FROM search_docs WHERE item_id = ?', (item_id,)).fetchone()
+                if row is None:
+                    continue
+                ordinal, doc_tokens = row
+                doc_tokens = doc_tokens.split()
+                postings.extend((token, ordinal) for token in doc_tokens)
+                tokens.update(doc_tokens)
+                ordinals.add(ordinal)
+            self.conn.executemany('DELETE FROM search_postings WHERE token = ? AND ordinal = ?', postings)
+            self.conn.executemany('DELETE FROM search_docs WHERE ordinal = ?', [(ordinal,) for ordinal in ordinals])
+        return tokens, ordinals
+
+    def replace_search_documents(self, docs):
+        # docs: [(item_id, tokens)]. Re-indexed items keep their ordinal and only their changed
+        # tokens are rewritten. Returns the (tokens, ordinals) that changed.
+        tokens = set()
+        ordinals = set()
+        added = []
+        removed = []
+        with self.conn:
+            for item_id, doc_tokens in docs:
+                new = set(doc_tokens)
+                row = self.conn.execute('SELECT ordinal, tokens FROM search_docs WHERE item_id = ?', (item_id,)).fetchone()
+                if row:
+                    ordinal, old = row[0], set(row[1].split())
+                    self.conn.execute('UPDATE search_docs SET tokens = ? WHERE ordinal = ?', (' '.join(sorted(new)), ordinal))
+                else:
+                    ordinal = self.conn.execute('INSERT INTO search_docs (item_id, tokens) VALUES (?, ?)',
+                                                (item_id, ' '.join(sorted(new)))).lastrowid
+                    ordinals.add(ordinal)
+                    old = set()
+                removed.extend((token, ordinal) for token in old - new)
+                added.extend((token, ordinal) for token in new - old)
+                tokens |= old ^ new
+            self.conn.executemany('DELETE FROM search_postings WHERE token = ? AND ordinal = ?', removed)
+            # Key order keeps the bulk insert of a first build cheap
+            self.conn.executemany('INSERT INTO search_postings (token, ordinal) VALUES (?, ?)', sorted(added))
+        return tokens, ordinals
+
+    def search_postings(self, prefix):
+        # [(token, ordinal)] of the tokens starting with prefix, sorted
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return self.conn.execute(
+            'SELECT token, ordinal FROM search_postings WHERE token >= ? AND token < ? ORDER BY token, ordinal',
+            (prefix, upper),
+        ).fetchall()
+
+    def search_prefixes(self, length):
+        return [prefix for (prefix,) in self.conn.execute('SELECT DISTINCT substr(token, 1, ?) FROM search_postings', (length,))]
+
+    def search_doc_shards(self, size):
+        return [shard for (shard,) in self.conn.execute('SELECT DISTINCT ordinal / ? FROM search_docs', (size,))]
+
+    def search_docs(self, first, end):
+        return self.conn.execute(
+            'SELECT ordinal, item_id FROM search_docs WHERE ordinal >= ? AND ordinal < ?', (first, end)
+        ).fetchall()
+
+    def add_pending(self, items, attempted=()):
+        # Only items in attempted (their download started) use up an attempt; the rest
+        # were refused by the deadline or never left the queue and just stay pending
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO pending_media (item_id, source, msg_id, attempts) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(item_id) DO UPDATE SET attempts = attempts + excluded.attempts',
+                [(item['id'], item['source'], parse_msg_id(item['id']), int(item['id'] in attempted)) for item in items],
+            )
+
+    def clear_pending(self, item_ids):
+        with self.conn:
+            self.conn.executemany('DELETE FROM pending_media WHERE item_id = ?', [(i,) for i in item_ids])
+
+    def pending_media(self):
+        return self.conn.execute('SELECT item_id, source, msg_id, attempts FROM pending_media ORDER BY item_id').fetchall()
+
+    def cost_stats(self):
+        return dict(self.conn.execute('SELECT key, seconds FROM cost_stats'))
+
+    def update_costs(self, samples, combine):
+        # samples: {key: seconds}; combine(old, sample, count) gives the new estimate
+        with self.conn:
+            for key, sample in samples.items():
+                row = self.conn.execute('SELECT seconds, samples FROM cost_stats WHERE key = ?', (key,)).fetchone()
+                old, count = row if row else (0.0, 0)
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO cost_stats (key, seconds, samples) VALUES (?, ?, ?)',
+                    (key, combine(old, sample, count), count + 1),
+                )
+
+    def channel_rotation(self):
+        return dict(self.conn.execute('SELECT source, last_completed_at FROM channel_rotation'))
+
+    def mark_channels_completed(self, sources, when):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO channel_rotation (source, last_completed_at) VALUES (?, ?)',
+                [(source, when) for source in sources],
+            )
+
+    def unfinished_exports(self):
+        # [(generation, deleted_files)] of exports that never committed, oldest first
+        rows = self.conn.execute(
+            'SELECT generation, deleted_files FROM export_journal WHERE committed_at IS NULL ORDER BY generation'
+        ).fetchall()
+        return [(generation, json.loads(deleted)) for generation, deleted in rows]
+
+    def begin_export(self, now):
+        with self.conn:
+            return self.conn.execute('INSERT INTO export_journal (started_at) VALUES (?)', (now,)).lastrowid
+
+    def journal_deletes(self, generation, names):
+        with self.conn:
+            self.conn.execute('UPDATE export_journal SET deleted_files = ? WHERE generation = ?',
+                              (json.dumps(sorted(names)), generation))
+
+    def commit_export(self, generation, now):
+        # Also closes the interrupted exports this one rolled forward
+        with self.conn:
+            self.conn.execute('UPDATE export_journal SET committed_at = ? WHERE generation <= ? AND committed_at IS NULL',
+                              (now, generation))
+            self.conn.execute('DELETE FROM export_journal WHERE generation <= ?', (generation - JOURNAL_KEEP,))
+
+    def channel_pts(self):
+        return dict(self.conn.execute('SELECT source, pts FROM channel_pts'))
+
+    def set_channel_pts(self, pts_by_source):
+        with self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO channel_pts (source, pts) VALUES (?, ?)',
+                                  list(pts_by_source.items()))
+
+    def iter_latest(self):
+        # Newest first; ties broken by id so the export is deterministic.
+        # Near-duplicates are folded into the first item of their cluster, which lists
+        # every copy under 'sources'.
+        copies = self.cluster_copies()
+        for item_id, data in self.conn.execute(
+            'SELECT i.id, i.data FROM items i LEFT JOIN fingerprints f ON f.item_id = i.id '
+            'WHERE f.cluster IS NULL OR f.cluster = i.id ORDER BY i.date DESC, i.id ASC'
+        ):
+            item = json.loads(data)
+            item.pop('sources', None)
+            if item_id in copies:
+                item['sources'] = [{'source': item['source'], 'link': item.get('link'), 'date': item['date']}] + copies[item_id]
+            yield item
@@ -0,0 +1,153 @@
+# Compiled text cleaning engine for message text.
+# All patterns are compiled once per rule set. The link/junk rules run as a single
+# alternation, and the signatures are merged into one alternation that is used
+# to detect them: the rarely needed per-signature passes only run on messages
+# that actually contain one, which keeps the old rule-by-rule results.
+import json
+import os
+import re
+
+# Order matters: at any position the first matching alternative wins. This is one
+# left-to-right pass, not the old chain of re.sub calls, so where rules overlap the
+# result can differ: text left behind by one rule is no longer matched by a later one,
+# and a match can now swallow text an earlier rule used to cut off first
+# ("https://[📹]" used to become "https://", now it is removed whole).
+# The two agree on the usual Telegram markup.
+JUNK_PATTERNS = [
+    r'\[[^\]]+\]\(https?://[^\s)]+\)',          # markdown links [text](url)
+    r'\(\s*https?://[^\s)]+\s*\)',              # raw URLs in parentheses
+    r'\[\s*[a-zA-Z0-9.-]+\.[a-z]{2,}\s*\]',     # leftover brackets with domains
+    r'\[[📹📷🖼🎥]]',                            # Telegram media icons in brackets
+    r'https?://[^\s]+',                         # standalone URLs
+    r'/%[0-9A-Fa-f]{2}',                        # percent-encoded junk
+    r'%[0-9A-Fa-f]{2}',
+]
+
+DEFAULT_SIGNATURES = [
+    r'_+Farsi_Iranwire_+',
+    r'-- _IranintlTV',
+    r'VahidHeadline@ \W+',
+    r'VahidOnline@ \W+',
+    r'VahidOOnLine@ \W+',
+    r'VahidHeadline@',
+    r'VahidOnline@',
+    r'VahidOOnLine@',
+]
+
+BLANK_LINES_RE = re.compile(r'\n\s*\n')
+
+REGEX_SPECIAL = set('.^$*+?{}[]|()\\')
+
+
+def first_chars(patterns):
+    # Set of possible first characters (both cases), or None when a pattern doesn't start with a plain literal.
+    chars = set()
+    for pattern in patterns:
+        if len(pattern) >= 2 and pattern[0] == '\\' and not pattern[1].isalnum():
+            first, rest = pattern[1], pattern[2:]
+        elif pattern and pattern[0] not in REGEX_SPECIAL:
+            first, rest = pattern[0], pattern[1:]
+        else:
+            return None
+        if rest[:1] in ('?', '*', '{'):
+            return None
+        chars.update((first, first.lower(), first.upper()))
+    return chars
+
+
+def compile_alternation(patterns, flags=0):
+    alternation = '|'.join(f'(?:{p})' for p in patterns)
+    # Case-insensitive alternations can't use sre's literal prefix scan, so a
+    # first-character lookahead lets them skip most positions cheaply.
+    # (For case-sensitive ones sre already does this and the lookahead only slows it down.)
+    chars = first_chars(patterns) if flags & re.IGNORECASE else None
+    if chars:
+        alternation = '(?=[' + ''.join(re.escape(c) for c in sorted(chars)) + '])(?:' + alternation + ')'
+    return re.compile(alternation, flags)
+
+
+JUNK_RE = compile_alternation(JUNK_PATTERNS)
+
+
+class TextCleaner:
+    def __init__(self, signatures=DEFAULT_SIGNATURES):
+        self.signatures = list(signatures)
+        self.signature_re = compile_alternation(self.signatures, re.IGNORECASE) if self.signatures else None
+        self.signature_passes = [re.compile(sig, re.IGNORECASE) for sig in self.signatures]
+
+    def clean(self, text):
+        if not text:
+            return ""
+        text = JUNK_RE.sub('', text)
+        if self.signature_re is not None and self.signature_re.search(text):
+            # Rule by rule, so overlapping signatures resolve exactly as they always did
+            for sig_re in self.signature_passes:
+                text = sig_re.sub('', text)
+        text = BLANK_LINES_RE.sub('\n\n', text)
+        return text.strip()
+
+    def clean_batch(self, texts):
+        return [self.clean(text) for text in texts]
+
+
+class CleaningRules:
+    # Per-channel cleaners. Rules file format:
+    #   {"signatures": ["extra global regex", ...],
+    #    "channels": {"ChannelName": ["channel-only regex", ...]}}
+    def __init__(self, signatures=DEFAULT_SIGNATURES, channel_signatures=None):
+        self.signatures = list(signatures)
+        self.channel_signatures = channel_signatures or {}
+        self.default = TextCleaner(self.signatures)
+        self._cleaners = {}
+
+    @classmethod
+    def load(cls, path):
+        if not path or not os.path.exists(path):
+            return cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        return cls(DEFAULT_SIGNATURES + config.get('signatures', []), config.get('channels', {}))
+
+    def for_channel(self, channel_name):
+        extra = self.channel_signatures.get(channel_name)
+        if not extra:
+            return self.default
+        if channel_name not in self._cleaners:
+            self._cleaners[channel_name] = TextCleaner(self.signatures + extra)
+        return self._cleaners[channel_name]
+
+    def clean(self, text, channel_name=None):
+        return self.for_channel(channel_name).clean(text)
+
+    def clean_batch(self, texts, channel_name=None):
+        return self.for_channel(channel_name).clean_batch(texts)
+
+
+# --- Token normalization (duplicate fingerprints, search) ---
+
+# Arabic letter forms folded to their Persian ones, Persian/Arabic digits to ASCII,
+# diacritics and tatweel dropped, ZWNJ treated as a word break.
+# Applied as str.replace passes: str.translate goes through a dict lookup per character
+# and is several times slower on Persian text, where most of these never occur.
+TOKEN_FOLDS = [
+    ('ي', 'ی'), ('ى', 'ی'), ('ك', 'ک'), ('ة', 'ه'), ('ۀ', 'ه'),
+    ('أ', 'ا'), ('إ', 'ا'), ('آ', 'ا'), ('ٱ', 'ا'), ('ؤ', 'و'), ('ئ', 'ی'),
+    *[(chr(0x06F0 + d), str(d)) for d in range(10)],
+    *[(chr(0x0660 + d), str(d)) for d in range(10)],
+    *[(chr(c), '') for c in range(0x064B, 0x0660)],
+    ('ٰ', ''), ('ـ', ''),
+    ('‌', ' '),
+]
+TOKEN_RE = re.compile(r'\w+')
+URL_RE = re.compile(r'https?://\S+')
+
+
+def normalize_tokens(text):
+    # Lowercased word tokens with the folds above; "كتاب‌ها" and "کتاب ها" give the same tokens
+    if not text:
+        return []
+    text = URL_RE.sub(' ', text)
+    for char, replacement in TOKEN_FOLDS:
+        if char in text:
+            text = text.replace(char, replacement)
+    return TOKEN_RE.findall(text.lower())
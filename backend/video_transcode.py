@@ -0,0 +1,126 @@
+# Video transcoding planner.
+# Decides how to turn a Telegram video into something under the size cap *before*
+# spending CPU on it: remux when the source already fits and is H.264/AAC, otherwise
+# encode at a bitrate computed from the duration so the result is guaranteed to fit,
+# and skip videos that can't fit at any watchable bitrate.
+import asyncio
+import json
+import subprocess
+
+MAX_OUTPUT_BYTES = 22 * 1024 * 1024
+# Headroom for container overhead and VBV overshoot
+SIZE_SAFETY = 0.9
+# Below this the video isn't worth keeping; the poster is used instead
+MIN_VIDEO_KBPS = 120
+
+# (min video kbps, max width, fps, audio kbps, preset), best first.
+# Video bitrate is capped at the first column of the previous tier, so short clips don't waste bytes.
+TIERS = [
+    (700, 480, '24', 64, 'faster'),
+    (350, 360, '20', 48, 'veryfast'),
+    (MIN_VIDEO_KBPS, 360, '15', 32, 'ultrafast'),
+]
+MAX_VIDEO_KBPS = 1200
+
+COPY_VIDEO_CODECS = ('h264',)
+COPY_AUDIO_CODECS = ('aac', 'mp3', None)
+
+
+def info_from_document(document):
+    # Pre-download facts from Telegram's DocumentAttributeVideo
+    info = {'size': getattr(document, 'size', 0) or 0}
+    for attr in getattr(document, 'attributes', None) or []:
+        if hasattr(attr, 'duration') and hasattr(attr, 'w') and hasattr(attr, 'h'):
+            info.update(duration=float(attr.duration or 0), width=attr.w, height=attr.h)
+    return info
+
+
+def can_fit(duration, max_bytes=MAX_OUTPUT_BYTES):
+    # False when even the lowest tier can't get a video this long under the cap
+    if not duration:
+        return True
+    lowest = TIERS[-1]
+    return (lowest[0] + lowest[3]) * 1000 / 8 * duration <= max_bytes * SIZE_SAFETY
+
+
+async def probe_video(path):
+    proc = await asyncio.create_subprocess_exec(
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=duration,bit_rate:stream=codec_type,codec_name,width,height,pix_fmt',
+        '-of', 'json', path,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    out, _ = await proc.communicate()
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, 'ffprobe')
+    data = json.loads(out or b'{}')
+    fmt = data.get('format', {})
+    info = {
+        'duration': float(fmt.get('duration') or 0),
+        'bitrate': int(fmt.get('bit_rate') or 0),
+        'vcodec': None,
+        'acodec': None,
+    }
+    for stream in data.get('streams', []):
+        if stream.get('codec_type') == 'video' and info['vcodec'] is None:
+            info.update(vcodec=stream.get('codec_name'), width=stream.get('width'),
+                        height=stream.get('height'), pix_fmt=stream.get('pix_fmt'))
+        elif stream.get('codec_type') == 'audio' and info['acodec'] is None:
+            info['acodec'] = stream.get('codec_name')
+    return info
+
+
+def legacy_zone_plan(size_bytes):
+    # Size-zone fallback for when the duration is unknown
+    size_mb = size_bytes / (1024 * 1024)
+    if size_mb < 15:
+        return {'action': 'encode', 'crf': '28', 'preset': 'faster', 'width': 480, 'fps': '24', 'audio_kbps': 64, 'video_kbps': None}
+    if size_mb < 50:
+        return {'action': 'encode', 'crf': '34', 'preset': 'veryfast', 'width': 360, 'fps': '20', 'audio_kbps': 48, 'video_kbps': None}
+    return {'action': 'encode', 'crf': '40', 'preset': 'ultrafast', 'width': 360, 'fps': '15', 'audio_kbps': 32, 'video_kbps': None}
+
+
+def plan_transcode(info, size_bytes, max_bytes=MAX_OUTPUT_BYTES):
+    # Returns a plan dict with 'action' in ('copy', 'encode', 'skip') and a human 'reason'
+    if size_bytes <= max_bytes and info.get('vcodec') in COPY_VIDEO_CODECS \
+            and info.get('acodec') in COPY_AUDIO_CODECS and info.get('pix_fmt') in ('yuv420p', None):
+        return {'action': 'copy', 'reason': 'already H.264 and under the cap, remux only'}
+
+    duration = info.get('duration') or 0
+    if not duration:
+        plan = legacy_zone_plan(size_bytes)
+        plan['reason'] = 'unknown duration, size-zone compression'
+        return plan
+
+    total_kbps = max_bytes * SIZE_SAFETY * 8 / 1000 / duration
+    ceiling = MAX_VIDEO_KBPS
+    for min_kbps, width, fps, audio_kbps, preset in TIERS:
+        video_kbps = min(total_kbps - audio_kbps, ceiling)
+        if video_kbps >= min_kbps:
+            return {
+                'action': 'encode', 'crf': '28', 'preset': preset, 'width': width, 'fps': fps,
+                'audio_kbps': audio_kbps, 'video_kbps': int(video_kbps),
+                'reason': f'{duration:.0f}s at <= {int(video_kbps)}k video / {audio_kbps}k audio',
+            }
+        ceiling = min_kbps
+    return {'action': 'skip', 'reason': f'{duration:.0f}s can not fit in {max_bytes // (1024 * 1024)} MB'}
+
+
+def build_ffmpeg_cmd(src, dst, plan):
+    if plan['action'] == 'copy':
+        return ['ffmpeg', '-y', '-i', src, '-c', 'copy', '-movflags', 'faststart', dst]
+    cmd = [
+        'ffmpeg', '-y', '-i', src,
+        '-vcodec', 'libx264', '-crf', plan['crf'], '-preset', plan['preset'],
+    ]
+    if plan.get('video_kbps'):
+        # Capped CRF: quality-driven, but the peak rate bounds the final size
+        kbps = plan['video_kbps']
+        cmd += ['-maxrate', f'{kbps}k', '-bufsize', f'{kbps * 2}k']
+    cmd += [
+        '-r', plan['fps'],
+        '-acodec', 'aac', '-ac', '1', '-b:a', f"{plan['audio_kbps']}k", '-movflags', 'faststart',
+        '-vf', f"scale='min({plan['width']},iw)':-2",
+        dst,
+    ]
+    return cmd
@@ -0,0 +1,62 @@
+# Deadline-aware planning for a run.
+# Uses cost estimates learned from earlier runs (kept in the state store) to
+# order channels fairly, reserve time for writing the output, and decide whether
+# an expensive job (e.g. a video transcode) can still start before the deadline.
+import time
+
+# Exponential moving average weight of the newest sample
+EWMA_ALPHA = 0.3
+
+# Estimates used before any run has been measured (seconds)
+DEFAULT_COSTS = {
+    'post_fetch': 10.0,
+    'media:video': 30.0,
+    'media:photo': 1.0,
+    'channel': 5.0,
+    'reconcile': 5.0,
+}
+# Never plan with less than this reserved for merge/budget/sweep/write
+MIN_RESERVE = 5.0
+RESERVE_FACTOR = 1.5
+# ...but never more than this share of the whole run, so short runs still fetch
+MAX_RESERVE_SHARE = 0.5
+
+
+def ewma(old, sample, samples):
+    if not samples:
+        return sample
+    return old + EWMA_ALPHA * (sample - old)
+
+
+class WorkPlanner:
+    def __init__(self, costs, deadline):
+        self.costs = costs
+        self.deadline = deadline
+        # Work (fetch + media) must stop early enough to leave time for writing the output
+        self.reserve = max(MIN_RESERVE, self.estimate('post_fetch') * RESERVE_FACTOR)
+        self.reserve = min(self.reserve, max(0.0, deadline - time.time()) * MAX_RESERVE_SHARE)
+        self.work_deadline = deadline - self.reserve
+
+    def estimate(self, key):
+        if key in self.costs:
+            return self.costs[key]
+        if key.startswith('channel:'):
+            return DEFAULT_COSTS['channel']
+        return DEFAULT_COSTS.get(key, 0.0)
+
+    def remaining(self):
+        return self.work_deadline - time.time()
+
+    def can_start(self, key):
+        # Unmeasured work is always tried once so it can get a real estimate
+        if key not in self.costs:
+            return self.remaining() > 0
+        return self.remaining() >= self.costs[key]
+
+    def order_channels(self, channels, last_completed):
+        # Least recently completed first (never-completed channels lead), then cheapest first.
+        # Channels cut off by the deadline move to the front of the next run.
+        return sorted(
+            channels,
+            key=lambda ch: (last_completed.get(ch['name'], 0), self.estimate(f"channel:{ch['name']}")),
+        )